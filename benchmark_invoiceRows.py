@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Author: Jon Hall
+# Copyright (c) 2023
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Benchmark peak RSS of invoiceAnalysis.getInvoiceDetail against the mock SoftLayer client for two versions of invoiceAnalysis.py
+
+  before    invoiceAnalysis.py checked out from git revision BEFORE into a temporary directory and imported from there,
+            by default the commit before rows were accumulated in per-column lists where each row was appended to a
+            list as a copy of the row dict
+  after     invoiceAnalysis.py in the working tree, or checked out from git revision AFTER if given
+
+The other modules (usageStore, mock_softlayer, ...) are imported from the working tree for both versions, so the
+difference also includes any other change to invoiceAnalysis.py between the two revisions.  Pass the commit that
+made the change as --after to measure that change alone.
+Each version runs in its own process so ru_maxrss is the peak of that run only.
+
+usage: python benchmark_invoiceRows.py [--before BEFORE] [--after AFTER] [--months MONTHS] [--items ITEMS] [--workers WORKERS]
+"""
+
+__author__ = 'jonhall'
+import argparse, json, logging, os, resource, subprocess, sys, tempfile, time
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+# commit before rows were accumulated in per-column lists instead of dict copies
+baselineRevision = "c2e7753"
+
+def getMaxRSS():
+    """
+    Return peak resident set size of this process in MB, ru_maxrss is in KB on Linux and bytes on macOS
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        maxrss = maxrss / 1024
+    return maxrss / 1024
+
+def importInvoiceAnalysis(revision):
+    """
+    Import invoiceAnalysis.py from git revision, or from the working tree if revision is None
+    """
+    if revision == None:
+        import invoiceAnalysis
+        return invoiceAnalysis
+    repoDir = os.path.dirname(os.path.abspath(__file__))
+    source = subprocess.run(["git", "show", "{}:invoiceAnalysis.py".format(revision)], cwd=repoDir,
+                            check=True, capture_output=True, text=True).stdout
+    with tempfile.TemporaryDirectory(prefix="invoiceAnalysis-") as revisionDir:
+        with open(os.path.join(revisionDir, "invoiceAnalysis.py"), "w") as f:
+            f.write(source)
+        sys.path.insert(0, revisionDir)
+        import invoiceAnalysis
+        sys.path.remove(revisionDir)
+    return invoiceAnalysis
+
+def runVersion(version, revision, months, items, workers):
+    """
+    Run getInvoiceDetail of invoiceAnalysis.py at revision and return rows, seconds and RSS before and after the run
+    """
+    invoiceAnalysis = importInvoiceAnalysis(revision)
+    from mock_softlayer import MockSoftLayerClient
+
+    logging.basicConfig(level=logging.WARNING)
+    invoiceAnalysis.client = MockSoftLayerClient(account_id=123456, invoice_months=months, invoice_items=items)
+    invoiceAnalysis.ims_account = 123456
+    invoiceAnalysis.storageFlag = False
+    invoiceAnalysis.cacheDir = None
+    invoiceAnalysis.workers = workers
+
+    now = datetime.now()
+    startdate, enddate = invoiceAnalysis.getInvoiceDates((now - relativedelta(months=months - 1)).strftime("%Y-%m"),
+                                                         now.strftime("%Y-%m"))
+    startRSS = getMaxRSS()
+    startTime = time.perf_counter()
+    df = invoiceAnalysis.getInvoiceDetail(startdate, enddate)
+    return {"version": version, "revision": revision or "working tree", "rows": len(df), "seconds": round(time.perf_counter() - startTime, 2),
+            "startRSS": round(startRSS, 1), "peakRSS": round(getMaxRSS(), 1)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark peak RSS of two versions of invoiceAnalysis.getInvoiceDetail using the mock SoftLayer client.")
+    parser.add_argument("--before", default=baselineRevision, help="Git revision of invoiceAnalysis.py to use as the baseline.")
+    parser.add_argument("--after", default=None, help="Git revision of invoiceAnalysis.py to compare, defaults to the working tree.")
+    parser.add_argument("--months", type=int, default=3, help="Number of monthly invoices to parse.")
+    parser.add_argument("--items", type=int, default=10000, help="Number of top level items on each invoice.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent workers used to retrieve invoice line items.")
+    parser.add_argument("--version", choices=["before", "after"], help="Run a single version in this process and print the result as json.")
+    args = parser.parse_args()
+
+    revisions = {"before": args.before, "after": args.after}
+    if args.version != None:
+        print(json.dumps(runVersion(args.version, revisions[args.version], args.months, args.items, args.workers)))
+        quit()
+
+    results = []
+    for version, revision in revisions.items():
+        command = [sys.executable, __file__, "--version", version, "--before", args.before, "--months", str(args.months),
+                   "--items", str(args.items), "--workers", str(args.workers)]
+        if args.after != None:
+            command = command + ["--after", args.after]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    print("{:<8} {:<14} {:>10} {:>10} {:>16} {:>14}".format("version", "revision", "rows", "seconds", "RSS before (MB)", "peak RSS (MB)"))
+    for result in results:
+        print("{:<8} {:<14} {:>10,} {:>10} {:>16} {:>14}".format(result["version"], result["revision"], result["rows"],
+                                                                result["seconds"], result["startRSS"], result["peakRSS"]))
+    beforeRSS, afterRSS = results[0]["peakRSS"] - results[0]["startRSS"], results[1]["peakRSS"] - results[1]["startRSS"]
+    print("Peak RSS growth during getInvoiceDetail: before {:.1f} MB, after {:.1f} MB ({:.0%} lower).".format(
+        beforeRSS, afterRSS, 1 - afterRSS / beforeRSS if beforeRSS > 0 else 0))
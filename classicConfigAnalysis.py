@@ -18,6 +18,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
+import reportWriter
+import softlayerApi
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     # read logging.json for log parameters to be ued by script
@@ -53,7 +55,7 @@ def getinventory():
     offset = 0
 
     while True:
-        hardwarelist = client['Account'].getHardware(id=ims_account, limit=limit, offset=offset, mask='datacenter,datacenterName,motherboard,processors,networkVlans,backendRouters,frontendRouters,backendNetworkComponentCount,backendNetworkComponents,'\
+        hardwarelist = softlayerApi.callAPI(client, 'Account', 'getHardware', id=ims_account, limit=limit, offset=offset, mask='datacenter,datacenterName,motherboard,processors,networkVlans,backendRouters,frontendRouters,backendNetworkComponentCount,backendNetworkComponents,'\
                 'backendNetworkComponents.router,backendNetworkComponents.router.primaryIpAddress,backendNetworkComponents.uplinkComponent,backendNetworkComponents.primarySubnet,frontendNetworkComponentCount,frontendNetworkComponents,frontendNetworkComponents.router,'
                 'frontendNetworkComponents.router.primaryIpAddress,frontendNetworkComponents.uplinkComponent,frontendNetworkComponents.primarySubnet,uplinkNetworkComponents,networkGatewayMemberFlag,softwareComponents,frontendNetworkComponents.duplexMode,backendNetworkComponents.duplexMode')
 
@@ -82,7 +84,7 @@ def getinventory():
                 if backend['name'] == "eth":
                     backendnetworkcomponent = backend
                     # Get trunked vlans because relational item doesn't return correctly
-                    backendnetworkcomponent['networkVlanTrunks'] = client['Network_Component'].getNetworkVlanTrunks(mask='networkVlan', id=backendnetworkcomponent['uplinkComponent']['id'])
+                    backendnetworkcomponent['networkVlanTrunks'] = softlayerApi.callAPI(client, 'Network_Component', 'getNetworkVlanTrunks', mask='networkVlan', id=backendnetworkcomponent['uplinkComponent']['id'])
                     backendnetworkcomponents.append(backendnetworkcomponent)
                     if "primarySubnet" in backend:
                         backend_primarySubnet = ("{}/{}".format(backend["primarySubnet"]["networkIdentifier"], backend["primarySubnet"]["cidr"]))
@@ -466,8 +468,8 @@ def createPrivateSubnetPivot(hardware_df):
                                aggfunc={"id": "nunique"}, margins=True, margins_name="Count", fill_value=0).rename(columns={'id': 'Total Count'})
     processor.to_excel(writer, 'PrivateSubnetPivot')
     worksheet = writer.sheets['PrivateSubnetPivot']
-    leftformat = workbook.add_format({'align': 'left'})
-    format1 = workbook.add_format({'num_format': '#,##0'})
+    leftformat = reportWriter.getFormat(workbook, "left")
+    format1 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 20, leftformat)
     worksheet.set_column("B:B", 60, leftformat)
     worksheet.set_column("C:C", 10, format1)
@@ -484,8 +486,8 @@ def createPublicSubnetPivot(hardware_df):
                                aggfunc={"id": "nunique"}, margins=True, margins_name="Count", fill_value=0).rename(columns={'id': 'Total Count'})
     processor.to_excel(writer, 'PublicSubnetPivot')
     worksheet = writer.sheets['PublicSubnetPivot']
-    leftformat = workbook.add_format({'align': 'left'})
-    format1 = workbook.add_format({'num_format': '#,##0'})
+    leftformat = reportWriter.getFormat(workbook, "left")
+    format1 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 20, leftformat)
     worksheet.set_column("B:B", 60, leftformat)
     worksheet.set_column("C:C", 10, format1)
@@ -501,8 +503,8 @@ def createProcessorPivot(hardware_df):
                                aggfunc={"id": "nunique"}, margins=True, margins_name="Count", fill_value=0).rename(columns={'id': 'Total Count'})
     processor.to_excel(writer, 'ProcessorPivot')
     worksheet = writer.sheets['ProcessorPivot']
-    leftformat = workbook.add_format({'align': 'left'})
-    format1 = workbook.add_format({'num_format': '#,##0'})
+    leftformat = reportWriter.getFormat(workbook, "left")
+    format1 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 20, leftformat)
     worksheet.set_column("B:B", 60, leftformat)
     worksheet.set_column("C:C", 10, format1)
@@ -518,8 +520,8 @@ def createMotherboardPivot(hardware_df):
                                aggfunc={"id": "nunique"}, margins=True, margins_name="Count", fill_value=0).rename(columns={'id': 'Total Count'})
     processor.to_excel(writer, 'MotherboardPivot')
     worksheet = writer.sheets['MotherboardPivot']
-    leftformat = workbook.add_format({'align': 'left'})
-    format1 = workbook.add_format({'num_format': '#,##0'})
+    leftformat = reportWriter.getFormat(workbook, "left")
+    format1 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 20, leftformat)
     worksheet.set_column("B:B", 75, leftformat)
     worksheet.set_column("C:C", 10, format1)
@@ -537,8 +539,8 @@ def createHostsByDatePivot(hardware_df):
                                margins=True, margins_name="Count", fill_value=0).rename(columns={'id': 'Total Count'})
     processor.to_excel(writer, 'ProvisionMonth')
     worksheet = writer.sheets['ProvisionMonth']
-    leftformat = workbook.add_format({'align': 'left'})
-    format1 = workbook.add_format({'num_format': '#,##0'})
+    leftformat = reportWriter.getFormat(workbook, "left")
+    format1 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 15, leftformat)
     worksheet.set_column("B:B", 75, leftformat)
     worksheet.set_column("C:D", 50, leftformat)
@@ -553,7 +555,7 @@ def createVlanDetail(trunkedvlan_df):
     # Write dataframe to excel
     trunkedvlan_df.to_excel(writer, "trunkedVLAN_Detail")
     worksheet = writer.sheets['trunkedVLAN_Detail']
-    leftformat = workbook.add_format({'align': 'left'})
+    leftformat = reportWriter.getFormat(workbook, "left")
     worksheet.set_column("B:B", 20, leftformat)
     worksheet.set_column("C:C", 20, leftformat)
     worksheet.set_column("D:D", 40, leftformat)
@@ -574,7 +576,7 @@ def createServersByTrunkedVlan(trunkedvlan_df):
                                aggfunc={"interface": "nunique"}, margins=True, margins_name="Count", fill_value=0).reset_index()
     vlanpivot.to_excel(writer, 'ServersByTrunkedVlanPivot')
     worksheet = writer.sheets['ServersByTrunkedVlanPivot']
-    leftformat = workbook.add_format({'align': 'left'})
+    leftformat = reportWriter.getFormat(workbook, "left")
     worksheet.set_column("A:A", 5, leftformat)
     worksheet.set_column("B:B", 20, leftformat)
     worksheet.set_column("C:C", 40, leftformat)
@@ -596,8 +598,8 @@ def createServersbyOsPivot(hardware_df):
                                aggfunc={"id": "nunique"}, margins=True, margins_name="Count", fill_value=0).rename(columns={'id': 'Total Count'})
     vlanpivot.to_excel(writer, 'ServerByOSPivot')
     worksheet = writer.sheets['ServerByOSPivot']
-    leftformat = workbook.add_format({'align': 'left'})
-    format1 = workbook.add_format({'num_format': '#,##0'})
+    leftformat = reportWriter.getFormat(workbook, "left")
+    format1 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 30, leftformat)
     worksheet.set_column("B:B", 40, leftformat)
     #worksheet.set_column("C:C", 60, leftformat)
@@ -614,7 +616,7 @@ def createTaggedVlanbyServersPivot(hardware_df):
                                aggfunc={"interface": "nunique"}, margins=True, margins_name="Count", fill_value=0).reset_index()
     vlanpivot.to_excel(writer, 'TaggedVlanByServer')
     worksheet = writer.sheets['TaggedVlanByServer']
-    leftformat = workbook.add_format({'align': 'left'})
+    leftformat = reportWriter.getFormat(workbook, "left")
     worksheet.set_column("A:A", 10, leftformat)
     worksheet.set_column("B:B", 30, leftformat)
     worksheet.set_column("C:C", 30, leftformat)
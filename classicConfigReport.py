@@ -6,6 +6,7 @@
 
 import SoftLayer, json, os, argparse, logging, logging.config
 from dotenv import load_dotenv
+import softlayerApi
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     # read logging.json for log parameters to be ued by script
@@ -168,7 +169,7 @@ if __name__ == "__main__":
         limit = 10
         offset = 0
         while True:
-            hardwarelist = client['Account'].getHardware(id=ims_account, limit=limit, offset=offset, mask='datacenter,datacenterName,networkVlans,backendRouters,frontendRouters,backendNetworkComponentCount,backendNetworkComponents,'\
+            hardwarelist = softlayerApi.callAPI(client, 'Account', 'getHardware', id=ims_account, limit=limit, offset=offset, mask='datacenter,datacenterName,networkVlans,backendRouters,frontendRouters,backendNetworkComponentCount,backendNetworkComponents,'\
                     'backendNetworkComponents.router,backendNetworkComponents.router.primaryIpAddress,backendNetworkComponents.duplexMode,backendNetworkComponents.uplinkComponent,frontendNetworkComponentCount,frontendNetworkComponents,frontendNetworkComponents.router,'
                     'frontendNetworkComponents.duplexMode,frontendNetworkComponents.router.primaryIpAddress,frontendNetworkComponents.uplinkComponent,uplinkNetworkComponents,activeComponents,processors,networkGatewayMemberFlag,softwareComponents')
 
@@ -196,7 +197,7 @@ if __name__ == "__main__":
                     if backend['name'] == "eth":
                         backendnetworkcomponent = backend
                         # Get trunked vlans because relational item doesn't return correctly
-                        backendnetworkcomponent['networkVlanTrunks'] = client['Network_Component'].getNetworkVlanTrunks(mask='networkVlan', id=backendnetworkcomponent['uplinkComponent']['id'])
+                        backendnetworkcomponent['networkVlanTrunks'] = softlayerApi.callAPI(client, 'Network_Component', 'getNetworkVlanTrunks', mask='networkVlan', id=backendnetworkcomponent['uplinkComponent']['id'])
                         backendnetworkcomponents.append(backendnetworkcomponent)
 
                 # FIND INFORMATION ABOUT PUBLIC (FRONTEND) INTERFACES
@@ -440,7 +441,7 @@ if __name__ == "__main__":
                 # GET NETWORK STORAGE
                 #
 
-                storagealloc = client['Hardware'].getAllowedNetworkStorage(mask="iops", id=hardwareid)
+                storagealloc = softlayerApi.callAPI(client, 'Hardware', 'getAllowedNetworkStorage', mask="iops", id=hardwareid)
                 if len(storagealloc) > 0:
                     data = []
                     for storage in storagealloc:
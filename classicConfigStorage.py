@@ -6,6 +6,7 @@ import SoftLayer, json, os, argparse, logging, logging.config
 from dotenv import load_dotenv
 from mock_softlayer import MockSoftLayerClient
 from SoftLayer.exceptions import SoftLayerAPIError
+import softlayerApi
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     # read logging.json for log parameters to be ued by script
@@ -151,7 +152,10 @@ def get_account_hardware_storage(client, account_id, limit=10):
     mask = 'id,datacenter.name,softwareComponents,allowedNetworkStorage.capacityGb,allowedNetworkStorage.nasType,allowedNetworkStorage.bytesUsed,allowedNetworkStorage.iops'
     
     while True:
-        hardware_list = client['Account'].getHardware(
+        hardware_list = softlayerApi.callAPI(
+            client,
+            'Account',
+            'getHardware',
             id=account_id, 
             limit=limit, 
             offset=offset, 
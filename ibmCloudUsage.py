@@ -16,6 +16,7 @@
 
 __author__ = 'jonhall'
 import os, logging, logging.config, os.path, argparse, base64, requests, pytz
+import concurrent.futures, collections, queue, threading
 import pandas as pd
 from datetime import datetime, timezone
 from dateutil.relativedelta import *
@@ -34,7 +35,11 @@ from ibm_vpc import VpcV1
 from ibm_cloud_sdk_core import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from dotenv import load_dotenv
+import usageStore
+import reportWriter
 
+# instance usage pages buffered per month ahead of parsing, workers months are retrieved at a time
+monthPageBuffer = 2
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     # read logging.json for log parameters to be ued by script
@@ -294,31 +299,49 @@ def prePopulateResourceCache():
         resource_cache[resourceId] = resource
 
     return resource_cache
+def getAccountUsageMonth(usageMonth):
+    """
+    Retrieve account usage for one month using the usage reports service retry configuration.
+    Returns None if usage is not available for the month, other API errors are raised to the caller.
+    """
+    logging.info("Retrieving Account Usage from {}.".format(usageMonth))
+    try:
+        usage = usage_reports_service.get_account_usage(
+            account_id=accountId,
+            billingmonth=usageMonth,
+            names=True
+        ).get_result()
+    except ApiException as e:
+        if e.code == 424:
+            logging.warning("API exception {}.".format(str(e)))
+            return None
+        else:
+            logging.error("API exception {}.".format(str(e)))
+            raise
+    return usage
 def getAccountUsage(start, end):
     """
     Get IBM Cloud Service from account for range of months.
     Note: This usage will bill two months later for SLIC.  For example April Usage, will invoice on the end of June CFTS invoice.
+    Months are retrieved concurrently by a pool of workers and parsed in month order.
     """
-    data = []
+    usageMonths = []
     while start <= end:
-        usageMonth = start.strftime("%Y-%m")
-        logging.info("Retrieving Account Usage from {}.".format(usageMonth))
+        usageMonths.append(start.strftime("%Y-%m"))
         start += relativedelta(months=+1)
 
+    data = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(getAccountUsageMonth, usageMonth) for usageMonth in usageMonths]
+    for usageMonth, future in zip(usageMonths, futures):
         try:
-            usage = usage_reports_service.get_account_usage(
-                account_id=accountId,
-                billingmonth=usageMonth,
-                names=True
-            ).get_result()
-        except ApiException as e:
-            if e.code == 424:
-                logging.warning("API exception {}.".format(str(e)))
-                continue
-            else:
-                logging.error("API exception {}.".format(str(e)))
-                quit(1)
-
+            usage = future.result()
+        except ApiException:
+            """ error has been logged, cancel the remaining months and exit from the main thread """
+            executor.shutdown(wait=False, cancel_futures=True)
+            quit(1)
+        if usage is None:
+            continue
         logging.debug("usage {}={}".format(usageMonth, usage))
         for resource in usage['resources']:
             for plan in resource['plans']:
@@ -353,7 +376,7 @@ def getAccountUsage(start, end):
                         row['price'] = "[]"
                     # add row to data
                     data.append(row.copy())
-
+    executor.shutdown()
 
     accountUsage = pd.DataFrame(data, columns=['account_id', 'month', 'currency_code', 'billing_country', 'resource_id', 'resource_name',
                     'billable_charges', 'billable_rated_charges', 'plan_id', 'plan_name', 'metric', 'unit_name', 'quantity',
@@ -434,14 +457,20 @@ def getInstancesUsage(start,end):
                 logging.warning(
                     "Get VPC image data {} in {} failed with status code {}:{}".format(id, region, str(e.code),
                                                                                        e.message))
-                result = {}
+                """
+                A missing image is cached as {} so it is not retried for every usage row, other errors (ie. rate
+                limiting or server errors) are not cached so the image is retried on the next lookup
+                """
+                if e.code == 404:
+                    logging.info("Caching missing VPC image {} in image_cache.".format(id))
+                    image_cache[id] = {}
+                return {}
 
             """
-            If valid result, add to cache for next lookup
+            Add to cache for next lookup
             """
-            if result != {}:
-                logging.info("Caching VPC image data for image {} in image_cache.".format(id))
-                image_cache[id] = result
+            logging.info("Caching VPC image data for image {} in image_cache.".format(id))
+            image_cache[id] = result
             return result
 
         global image_cache
@@ -487,7 +516,14 @@ def getInstancesUsage(start,end):
         return instance_data
 
     def getBMInitialization(region, id):
-        """ Retrieve BM intitialization Image to determine Operating System Info """
+        """
+        Retrieve BM intitialization Image to determine Operating System Info
+        The initialization image id is cached by server id so each server is only looked up once across months.
+        """
+        global bm_initialization_cache
+        if id in bm_initialization_cache:
+            return getImage(region, bm_initialization_cache[id])
+
         endpoint = next((item["endpoint"] for item in endpoints if item["region"] == region), False)
         if endpoint is False:
             logging.error("No valid VPC Endpoint found for region {}".format(region))
@@ -502,10 +538,71 @@ def getInstancesUsage(start,end):
             quit(1)
 
         image_id = bare_metal_server_initialization["image"]["id"]
+        bm_initialization_cache[id] = image_id
         image_data = getImage(region, image_id)
 
         return image_data
 
+    def putPage(pages, page):
+        """
+        Put page on the bounded pages queue, waiting while the queue is full unless retrieval has been cancelled.
+        Returns False if retrieval was cancelled.
+        """
+        while not cancelled.is_set():
+            try:
+                pages.put(page, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def getPage(producer, pages):
+        """
+        Return the next page of a month, or None after the last page or once the producer has stopped
+        """
+        while True:
+            try:
+                return pages.get(timeout=1)
+            except queue.Empty:
+                if producer.done() and pages.empty():
+                    return None
+
+    def getInstancesUsagePages(usageMonth, pages):
+        """
+        Producer for one month, retrieve each page following the next offset cursor and put it on the pages queue
+        so it can be parsed while the next page is requested.  None is put on the queue after the last page.
+        On an API error all producers are cancelled and the error is raised through the producer future.
+        """
+        try:
+            logging.info("Retrieving Instances Usage from {}.".format(usageMonth))
+            recordstart = 1
+            nextoffset = None
+            while not cancelled.is_set():
+                try:
+                    if nextoffset == None:
+                        instances_usage = usage_reports_service.get_resource_usage_account(
+                            account_id=accountId,
+                            billingmonth=usageMonth, names=True, limit=limit).get_result()
+                    else:
+                        instances_usage = usage_reports_service.get_resource_usage_account(
+                            account_id=accountId,
+                            billingmonth=usageMonth, names=True, limit=limit, start=nextoffset).get_result()
+                except ApiException as e:
+                    logging.error("Error with get_resource_usage_account: {}".format(e))
+                    cancelled.set()
+                    raise
+
+                recordstop = min(recordstart + limit - 1, instances_usage["count"])
+                logging.info("Requesting Instance {} Usage: retrieved from {} to {} of Total {}".format(usageMonth, recordstart,
+                                                                                                        recordstop,
+                                                                                                        instances_usage["count"]))
+                if not putPage(pages, instances_usage) or "next" not in instances_usage:
+                    break
+                nextoffset = instances_usage["next"]["offset"]
+                recordstart = recordstart + limit
+        finally:
+            putPage(pages, None)
+        return
 
     global vpc_instance_cache, tag_cache, resource_controller_cache
     data = []
@@ -513,34 +610,42 @@ def getInstancesUsage(start,end):
 
     limit = 200  ## set limit of record returned
 
-    """ Loop through months """
+    """
+    Months are retrieved concurrently by a pool of workers, each month following its own page cursor.  Pages are
+    parsed here in month and page order while the remaining pages are retrieved.  Only workers months are retrieved
+    at a time and each month buffers at most monthPageBuffer pages, the next month is submitted as each month is
+    parsed so retrieved pages do not build up in memory ahead of parsing.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    cancelled = threading.Event()
+    usageMonths = []
     while start <= end:
-        usageMonth = start.strftime("%Y-%m")
-        logging.info("Retrieving Instances Usage from {}.".format(usageMonth))
+        usageMonths.append(start.strftime("%Y-%m"))
         start += relativedelta(months=+1)
-        try:
-            instances_usage = usage_reports_service.get_resource_usage_account(
-                account_id=accountId,
-                billingmonth=usageMonth, names=True, limit=limit).get_result()
-        except ApiException as e:
-            logging.error("Fatal Error with get_resource_usage_account: {}".format(e))
-            quit(1)
-
-        recordstart = 1
-        if recordstart + limit > instances_usage["count"]:
-            recordstop = instances_usage["count"]
-        else:
-            recordstop = recordstart + limit - 1
-        logging.info("Requesting Instance {} Usage: retrieved from {} to {} of Total {}".format(usageMonth, recordstart,
-                                                                                                recordstop,
-                                                                                                instances_usage[
-                                                                                                    "count"]))
-        if "next" in instances_usage:
-            nextoffset = instances_usage["next"]["offset"]
-        else:
-            nextoffset = ""
-
+    pendingMonths = iter(usageMonths)
+    monthPages = collections.deque()
+
+    def submitNextMonth():
+        """ submit the producer for the next month in parse order to the pool """
+        usageMonth = next(pendingMonths, None)
+        if usageMonth != None:
+            pages = queue.Queue(maxsize=monthPageBuffer)
+            monthPages.append((executor.submit(getInstancesUsagePages, usageMonth, pages), pages))
+
+    def getMonthPages():
+        """ yield (producer, pages) for each month in order, the next month is submitted as each month is parsed """
+        while len(monthPages) > 0:
+            yield monthPages.popleft()
+            submitNextMonth()
+
+    for i in range(workers):
+        submitNextMonth()
+
+    for producer, pages in getMonthPages():
         while True:
+            instances_usage = getPage(producer, pages)
+            if instances_usage is None:
+                break
             for instance in instances_usage["resources"]:
                 logging.debug("Parsing Details for Instance {} in account {} of service {}..".format( instance["resource_instance_id"], instance["account_id"], instance["resource_id"]))
                 pricing_country = instance.get("pricing_country", "")
@@ -1010,96 +1115,109 @@ def getInstancesUsage(start,end):
                     row = row | row_addition
 
                     data.append(row.copy())
+        """ a producer error cancels all producers, the error has been logged so exit from the main thread """
+        if cancelled.is_set():
+            executor.shutdown(wait=False, cancel_futures=True)
+            quit(1)
+        producer.result()
+    executor.shutdown()
 
-            if nextoffset != "":
-                recordstart = recordstart + limit
-                if recordstart + limit > instances_usage["count"]:
-                    recordstop = instances_usage["count"]
-                else:
-                    recordstop = recordstart + limit - 1
-                logging.info("Requesting Instance {} Usage: retrieving from {} to {} of Total {}".format(usageMonth, recordstart,
-                                                                                              recordstop,
-                                                                                              instances_usage["count"]))
-                try:
-                    instances_usage = usage_reports_service.get_resource_usage_account(
-                        account_id=accountId,
-                        billingmonth=usageMonth, names=True,limit=limit, start=nextoffset).get_result()
-                except ApiException as e:
-                    logging.error("Error with get_resource_usage_account: {}".format(e))
-                    quit(1)
-
-                if "next" in instances_usage:
-                    nextoffset = instances_usage["next"]["offset"]
-                else:
-                    nextoffset = ""
-            else:
-                break
-
-        """ created Datatable from List if data exists otherwise initialize an empty dataframe """
-        if len(data) > 0:
-            instancesUsage = pd.DataFrame(data, columns=list(data[0].keys()))
-        else:
-            instancesUsage = pd.DataFrame()
+    """ created Datatable from List if data exists otherwise initialize an empty dataframe """
+    if len(data) > 0:
+        instancesUsage = pd.DataFrame(data, columns=list(data[0].keys()))
+    else:
+        instancesUsage = pd.DataFrame()
 
     return instancesUsage
+def listVPCResources(endpoint, listMethod, resultKey, description, required=True, cancelled=None):
+    """
+    Return every resource from a paged VPC regional list method, ie. list_instances returning instances
+    If not required a failed listing is logged as a warning and the resources retrieved so far are returned, otherwise
+    the ApiException is logged, cancelled is set so listings sharing it stop paging, and the error is raised.
+    """
+    resources = []
+    start = None
+    while cancelled == None or not cancelled.is_set():
+        try:
+            if start == None:
+                result = getattr(endpoint, listMethod)().get_result()
+            else:
+                result = getattr(endpoint, listMethod)(start=start).get_result()
+        except ApiException as e:
+            if not required:
+                logging.warning("{} with status code {}:{}".format(description, str(e.code), e.message))
+                return resources
+            logging.error("{} with status code {}:{}".format(description, str(e.code), e.message))
+            if cancelled != None:
+                cancelled.set()
+            raise
+
+        resources.extend(result[resultKey])
+        if "next" not in result:
+            return resources
+        start = dict(parse.parse_qsl(parse.urlsplit(result["next"]["href"]).query))["start"]
+    return resources
 def populateVPCInstanceCache():
     """
     Get VPC instance information and create cache from each VPC regional endpoint
+    Virtual server and bare metal listings of every region are retrieved concurrently, so most regions which are empty
+    only cost one round trip in parallel with the others.
     """
 
     logging.info("VPC Cache being pre-populated with Virtual sever details for account.")
-    items = []
-
+    listings = []
     for ep in endpoints:
-        """ Get virtual servers fro each VPC endpoint """
-        endpoint = ep["endpoint"]
-        instances = endpoint.list_instances()
-        while True:
-            try:
-                result = instances.get_result()
-            except ApiException as e:
-                logging.error("List VPC virtual server instances with status code{}:{}".format(str(e.code), e.message))
-                quit(1)
-
-            items = items + result["instances"]
-            if "next" not in result:
-                break
-            else:
-                next = dict(parse.parse_qsl(parse.urlsplit(result["next"]["href"]).query))
-                instances = endpoint.list_instances(start=next["start"])
-
-        """ Get Bare Metal"""
-        instances = endpoint.list_bare_metal_servers()
-        while True:
-            try:
-                result = instances.get_result()
-            except ApiException as e:
-                logging.error("List BM server instances with status code {}:{}".format(str(e.code), e.message))
-                quit(1)
-
-            items = items + result["bare_metal_servers"]
-            if "next" not in result:
-                break
-            else:
-                next = dict(parse.parse_qsl(parse.urlsplit(result["next"]["href"]).query))
-                instances = endpoint.list_bare_metal_servers(start=next["start"])
+        listings.append((ep["endpoint"], "list_instances", "instances", "List VPC virtual server instances"))
+        listings.append((ep["endpoint"], "list_bare_metal_servers", "bare_metal_servers", "List BM server instances"))
 
     instance_cache = {}
-    for resource in items:
-        crn = resource["crn"]
-        instance_cache[crn] = resource
+    cancelled = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(listings))
+    futures = [executor.submit(listVPCResources, *listing, cancelled=cancelled) for listing in listings]
+    for future in futures:
+        try:
+            resources = future.result()
+        except ApiException:
+            """ error has been logged and the other listings cancelled, exit from the main thread """
+            executor.shutdown(wait=False, cancel_futures=True)
+            quit(1)
+        for resource in resources:
+            instance_cache[resource["crn"]] = resource
+    executor.shutdown()
 
     return instance_cache
+def populateImageCache():
+    """
+    Get VPC image information and create image cache from each VPC regional endpoint
+    Images of every region are listed concurrently so the OS of most instances is found without a get_image call per
+    image, images not listed (ie. deleted) are looked up individually by getImage.
+    """
+
+    logging.info("VPC Image cache being pre-populated with image details for account.")
+    image_cache = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+        futures = [executor.submit(listVPCResources, ep["endpoint"], "list_images", "images",
+                                   "List VPC images in {}".format(ep["region"]), False) for ep in endpoints]
+        for future in futures:
+            for image in future.result():
+                image_cache[image["id"]] = image
+
+    logging.info("{} VPC images cached.".format(len(image_cache)))
+    return image_cache
 def populateClusterCache():
     """
     Get list of Kubernetes Clusters and Worker Nodes
+    Cluster detail and worker lists are retrieved concurrently on one keep-alive session, then each distinct VPC and
+    subnet used by the clusters is looked up once.
     :return:
     """
     logging.info("Kubernetes worker cache being pre-populated from account.")
     cluster_cache = {}
     worker_cache = {}
-    headers = {"Authorization": "Bearer "+authenticator.token_manager.get_token()}
-    resp = requests.get('https://containers.cloud.ibm.com/global/v2/vpc/getClusters', headers=headers)
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+    session.headers.update({"Authorization": "Bearer "+authenticator.token_manager.get_token()})
+    resp = session.get('https://containers.cloud.ibm.com/global/v2/vpc/getClusters')
     if resp.status_code == 200:
         clusters = json.loads(resp.content)
     else:
@@ -1107,57 +1225,99 @@ def populateClusterCache():
         print("Error Data: {}".format(json.loads(resp.content)['errors']))
         quit(1)
 
+    def getClusterDetail(cluster_id):
+        """ Get detail including VPC that isn't available in getClusters, None if not available """
+        resp = session.get("https://containers.cloud.ibm.com/global/v2/vpc/getCluster?cluster={}".format(cluster_id))
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        return None
+
+    def getClusterWorkers(cluster_id):
+        """ Get worker nodes of cluster including deleted workers """
+        resp = session.get('https://containers.cloud.ibm.com/global/v2/vpc/getWorkers?cluster={}&showDeleted=True'.format(cluster_id))
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        print("{} Error getting clusters.".format(resp.status_code))
+        print("Error Data: {}".format(json.loads(resp.content)['errors']))
+        raise requests.HTTPError("{} Error getting workers for cluster {}.".format(resp.status_code, cluster_id), response=resp)
+
+    def getRegionEndpoint(region):
+        endpoint = next((item["endpoint"] for item in endpoints if item["region"] == region), False)
+        if endpoint is False:
+            logging.error("No valid VPC Endpoint found for K8 Cluster region {}".format(region))
+            raise LookupError("No valid VPC Endpoint found for K8 Cluster region {}".format(region))
+        return endpoint
+
+    def getVPCName(region, vpc_id, cluster_id):
+        try:
+            return getRegionEndpoint(region).get_vpc(vpc_id).result["name"]
+        except ApiException as e:
+            logging.warning(
+                "Get VPC data {} in {} failed with status code for k8 cluster {} {}:{}".format(vpc_id, region, cluster_id, str(e.code),
+                                                                             e.message))
+            raise
+
+    def getSubnetName(region, subnet_id, cluster_id):
+        try:
+            return getRegionEndpoint(region).get_subnet(subnet_id).result["name"]
+        except ApiException as e:
+            logging.warning(
+                "Get Subnet data {} in {} failed with status code for k8 cluster {} {}:{}".format(subnet_id, region, cluster_id, str(e.code),
+                                                                             e.message))
+            raise
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def getResult(future):
+        """
+        Return the result of a lookup, lookups raise their errors so on an error cancel the remaining lookups and
+        exit from the main thread
+        """
+        try:
+            return future.result()
+        except (ApiException, requests.HTTPError, LookupError):
+            executor.shutdown(wait=False, cancel_futures=True)
+            session.close()
+            quit(1)
+
+    clusterDetails = {cluster["id"]: executor.submit(getClusterDetail, cluster["id"]) for cluster in clusters}
+    clusterWorkers = {cluster["id"]: executor.submit(getClusterWorkers, cluster["id"]) for cluster in clusters}
+
+    """ Look up each distinct VPC and worker subnet once, many clusters share a VPC and many workers share a subnet """
+    vpcNames = {}
+    subnetNames = {}
     for cluster in clusters:
         cluster_id = cluster["id"]
-        """ Get detail including VPC that isn't available in getClusters"""
-        vpc = ""
-        resp = requests.get("https://containers.cloud.ibm.com/global/v2/vpc/getCluster?cluster={}".format(cluster_id), headers=headers)
-        if resp.status_code == 200:
-            cluster_detail = json.loads(resp.content)
-            """ Get VPC Name """
-            endpoint = next((item["endpoint"] for item in endpoints if item["region"] == cluster_detail["region"]), False)
-            if endpoint is False:
-                logging.error("No valid VPC Endpoint found for K8 Cluster region {}".format(cluster_detail["region"]))
-                quit()
-            try:
-                vpc = endpoint.get_vpc(cluster_detail["vpcs"][0])
-                result = vpc.result
-                vpc = result["name"]
-                cluster_detail["vpc"] = vpc
-            except ApiException as e:
-                logging.warning(
-                    "Get VPC data {} in {} failed with status code for k8 cluster {} {}:{}".format(id, cluster_detail["region"], cluster_id, str(e.code),
-                                                                                 e.message))
-                quit()
+        cluster_detail = getResult(clusterDetails[cluster_id])
+        if cluster_detail != None:
+            region = cluster_detail["region"]
+            vpcKey = (region, cluster_detail["vpcs"][0])
+            if vpcKey not in vpcNames:
+                vpcNames[vpcKey] = executor.submit(getVPCName, *vpcKey, cluster_id)
+        else:
+            region = cluster.get("region", "")
+        for worker in getResult(clusterWorkers[cluster_id]):
+            subnetKey = (region, worker["networkInterfaces"][0]["subnetID"])
+            if subnetKey not in subnetNames:
+                subnetNames[subnetKey] = executor.submit(getSubnetName, *subnetKey, cluster_id)
 
+    for cluster in clusters:
+        cluster_id = cluster["id"]
+        cluster_detail = getResult(clusterDetails[cluster_id])
+        vpc = ""
+        if cluster_detail != None:
+            region = cluster_detail["region"]
+            vpc = getResult(vpcNames[(region, cluster_detail["vpcs"][0])])
+            cluster_detail["vpc"] = vpc
             cluster_cache[cluster_id] = cluster_detail
-
-        resp = requests.get('https://containers.cloud.ibm.com/global/v2/vpc/getWorkers?cluster={}&showDeleted=True'.format(cluster_id), headers=headers)
-        if resp.status_code == 200:
-            workers = json.loads(resp.content)
         else:
-            print("{} Error getting clusters.".format(resp.status_code))
-            print("Error Data: {}".format(json.loads(resp.content)['errors']))
-            quit(1)
-        for worker in workers:
-            id = worker["id"]
+            region = cluster.get("region", "")
+        for worker in getResult(clusterWorkers[cluster_id]):
             worker["vpc"] = vpc
-            """ Get Subnet """
-            endpoint = next((item["endpoint"] for item in endpoints if item["region"] == cluster_detail["region"]), False)
-            if endpoint is False:
-                logging.error("No valid VPC Endpoint found for K8 Cluster region {}".format(cluster_detail["region"]))
-                quit()
-            try:
-                subnet = endpoint.get_subnet(worker["networkInterfaces"][0]["subnetID"])
-                result = subnet.result
-                subnet_name = result["name"]
-                worker["subnet"] = subnet_name
-            except ApiException as e:
-                logging.warning(
-                    "Get Subnet data {} in {} failed with status code for k8 cluster {} {}:{}".format(id, cluster_detail["region"], cluster_id, str(e.code),
-                                                                                 e.message))
-                quit()
-            worker_cache[id] = worker
+            worker["subnet"] = getResult(subnetNames[(region, worker["networkInterfaces"][0]["subnetID"])])
+            worker_cache[worker["id"]] = worker
+    executor.shutdown()
+    session.close()
     return cluster_cache, worker_cache
 def createServiceDetail(paasUsage):
     """
@@ -1165,17 +1325,17 @@ def createServiceDetail(paasUsage):
     """
     logging.info("Creating ServiceUsageDetail tab.")
 
-    paasUsage.to_excel(writer, sheet_name="ServiceUsageDetail")
-    worksheet = writer.sheets['ServiceUsageDetail']
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    worksheet.set_column("A:C", 12, format2)
-    worksheet.set_column("D:E", 25, format2)
-    worksheet.set_column("F:G", 18, format1)
-    worksheet.set_column("H:I", 25, format2)
-    worksheet.set_column("J:J", 18, format1)
-    totalrows,totalcols=paasUsage.shape
-    worksheet.autofilter(0,0,totalrows,totalcols)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    for sheetName, totalrows in reportWriter.writeDetail(writer, paasUsage, "ServiceUsageDetail"):
+        worksheet = writer.sheets[sheetName]
+        worksheet.set_column("A:C", 12, format2)
+        worksheet.set_column("D:E", 25, format2)
+        worksheet.set_column("F:G", 18, format1)
+        worksheet.set_column("H:I", 25, format2)
+        worksheet.set_column("J:J", 18, format1)
+        totalcols = paasUsage.shape[1]
+        worksheet.autofilter(0,0,totalrows,totalcols)
     return
 def createInstancesDetailTab(instancesUsage):
     """
@@ -1183,21 +1343,19 @@ def createInstancesDetailTab(instancesUsage):
     """
     logging.info("Creating instances detail tab.")
 
-    instancesUsage.to_excel(writer, sheet_name="Instances_Detail")
-    worksheet = writer.sheets['Instances_Detail']
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    worksheet.set_column("A:C", 12, format2)
-    worksheet.set_column("D:E", 25, format2)
-    worksheet.set_column("F:G", 18, format1)
-    worksheet.set_column("H:I", 25, format2)
-    worksheet.set_column("J:J", 18, format1)
-    totalrows,totalcols=instancesUsage.shape
-    worksheet.autofilter(0,0,totalrows,totalcols)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    for sheetName, totalrows in reportWriter.writeDetail(writer, instancesUsage, "Instances_Detail"):
+        worksheet = writer.sheets[sheetName]
+        worksheet.set_column("A:C", 12, format2)
+        worksheet.set_column("D:E", 25, format2)
+        worksheet.set_column("F:G", 18, format1)
+        worksheet.set_column("H:I", 25, format2)
+        worksheet.set_column("J:J", 18, format1)
+        totalcols = instancesUsage.shape[1]
+        worksheet.autofilter(0,0,totalrows,totalcols)
     return
-def createUsageSummaryTab(paasUsage):
-    logging.info("Creating Usage Summary tab.")
-
+def getUsageSummaryPivot(paasUsage):
     usageSummary = pd.pivot_table(paasUsage, index=["resource_name"],
                                     columns=["month"],
                                     values=["cost"],
@@ -1205,16 +1363,18 @@ def createUsageSummaryTab(paasUsage):
                                     fill_value=0)
     new_order = ["cost"]
     usageSummary = usageSummary.reindex(new_order, axis=1, level=0)
-    usageSummary.to_excel(writer, sheet_name='UsageSummary', startrow=2)
-    worksheet = writer.sheets['UsageSummary']
-    boldtext = workbook.add_format({'bold': True})
+    return usageSummary
+def createUsageSummaryTab(usageSummary):
+    logging.info("Creating Usage Summary tab.")
+    worksheet = workbook.add_worksheet('UsageSummary')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
+    usageSummary.to_excel(writer, sheet_name='UsageSummary', startrow=2)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
     worksheet.set_column("A:A", 35, format2)
     worksheet.set_column("B:ZZ", 18, format1)
-def createMetricSummary(paasUsage):
-    logging.info("Creating Metric Plan Summary tab.")
+def getMetricSummaryPivot(paasUsage):
     metricSummaryPlan = pd.pivot_table(paasUsage, index=["resource_name", "plan_name", "metric"],
                                  columns=["month"],
                                  values=["quantity", "cost"],
@@ -1222,17 +1382,19 @@ def createMetricSummary(paasUsage):
                                  fill_value=0)
     new_order = ["quantity", "cost"]
     metricSummaryPlan = metricSummaryPlan.reindex(new_order, axis=1, level=0)
-    metricSummaryPlan.to_excel(writer, sheet_name='MetricPlanSummary', startrow=2)
-    worksheet = writer.sheets['MetricPlanSummary']
-    boldtext = workbook.add_format({'bold': True})
+    return metricSummaryPlan, len(paasUsage.month.unique())
+def createMetricSummary(metricSummaryPlan, months):
+    logging.info("Creating Metric Plan Summary tab.")
+    worksheet = workbook.add_worksheet('MetricPlanSummary')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0.00000'})
+    metricSummaryPlan.to_excel(writer, sheet_name='MetricPlanSummary', startrow=2)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "metricUsage")
     worksheet.set_column("A:A", 30, format2)
     worksheet.set_column("B:B", 40, format2)
     worksheet.set_column("C:C", 40, format2)
-    months = len(paasUsage.month.unique())
     worksheet.set_column(3, 3 + months, 18, format3)
     worksheet.set_column(4 + months, 4 + (months * 2), 18, format1)
     return
@@ -1253,13 +1415,13 @@ def createChargesbyServer(servers):
 
     new_order = ["cost"]
     vcpu = vcpu.reindex(new_order, axis=1, level=0)
-    vcpu.to_excel(writer, 'ServerList',startrow=2)
-    worksheet = writer.sheets['ServerList']
-    boldtext = workbook.add_format({'bold': True})
+    worksheet = workbook.add_worksheet('ServerList')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
-    format4 = workbook.add_format({'num_format': '$#,##0.00'})
+    vcpu.to_excel(writer, 'ServerList',startrow=2)
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
+    format4 = reportWriter.getFormat(workbook, "currency")
     worksheet.set_column("A:A", 15, format2)
     worksheet.set_column("B:B", 25, format2)
     worksheet.set_column("C:C", 25, format2)
@@ -1269,8 +1431,7 @@ def createChargesbyServer(servers):
 
 
     return
-def createServerProvisioningTab(servers):
-    logging.info("Creating Server Provisioning Tab by User.")
+def getServerProvisioningPivot(servers):
     vcpu = pd.pivot_table(servers, index=["created_by_name", "region", "vpc", "instance_name", "service_name", "instance_profile", "provision_date", "deprovision_date", "instance_state"],
                                     columns=["month"],
                                     values=["cost"],
@@ -1280,13 +1441,16 @@ def createServerProvisioningTab(servers):
 
     new_order = ["cost"]
     vcpu = vcpu.reindex(new_order, axis=1, level=0)
-    vcpu.to_excel(writer, sheet_name='ServersByUser', startrow=2)
-    worksheet = writer.sheets['ServersByUser']
-    boldtext = workbook.add_format({'bold': True})
+    return vcpu
+def createServerProvisioningTab(vcpu):
+    logging.info("Creating Server Provisioning Tab by User.")
+    worksheet = workbook.add_worksheet('ServersByUser')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
-    format4 = workbook.add_format({'num_format': '$#,##0.00'})
+    vcpu.to_excel(writer, sheet_name='ServersByUser', startrow=2)
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
+    format4 = reportWriter.getFormat(workbook, "currency")
     worksheet.set_column("A:A", 25, format2)
     worksheet.set_column("B:B", 15, format2)
     worksheet.set_column("C:C", 15, format2)
@@ -1294,13 +1458,10 @@ def createServerProvisioningTab(servers):
     worksheet.set_column("E:I", 20, format2)
     worksheet.set_column("J:ZZ", 18, format4)
     return
-def createChargesCOSInstance(cos):
+def getChargesCOSInstancePivot(cos):
     """
     Create Table of COS INstances with Charge metrics
     """
-
-    logging.info("Calculating COS Instance charges.")
-
     pivot = pd.pivot_table(cos, index=["region", "resource_group_name", "instance_name", "plan_name", "metric", "unit"],
                              columns=["month"],
                              values=["quantity", "cost"],
@@ -1310,28 +1471,34 @@ def createChargesCOSInstance(cos):
 
     new_order = ["quantity", "cost"]
     pivot = pivot.reindex(new_order, axis=1, level=0)
+    return pivot, len(cos.month.unique())
+def createChargesCOSInstance(pivot, months):
+    """
+    Write COS Instance charges tab
+    """
 
-    pivot.to_excel(writer, sheet_name='COSBuckets', startrow=2)
-    worksheet = writer.sheets['COSBuckets']
-    boldtext = workbook.add_format({'bold': True})
+    logging.info("Calculating COS Instance charges.")
+
+    worksheet = workbook.add_worksheet('COSBuckets')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
-    format4 = workbook.add_format({'num_format': '$#,##0.00'})
+    pivot.to_excel(writer, sheet_name='COSBuckets', startrow=2)
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
+    format4 = reportWriter.getFormat(workbook, "currency")
     worksheet.set_column("A:A", 15, format2)
     worksheet.set_column("B:D", 30, format2)
     worksheet.set_column("E:E", 40, format2)
     worksheet.set_column("F:F", 18, format2)
 
     # Calculate and format Cost Columns by month
-    months = len(cos.month.unique())
     startcol = 6
     endcol = startcol + months
     worksheet.set_column(startcol, endcol, 10, format3)
     worksheet.set_column(endcol + 1, endcol + 2 + months, 15, format4)
 
     return
-def createVirtualServerTab(servers):
+def getVirtualServerPivot(servers):
     """
     Create Virtual Server Summary region, vpc, zone, and profile
     """
@@ -1339,8 +1506,6 @@ def createVirtualServerTab(servers):
     """ Query only virtual CPU,  VCPU metric and last month so it calculates current total VCPU """
     servers = servers.query('service_id == "is.instance"')
 
-    logging.info("Creating VPC Virtual Server Summary Tab.")
-
     vcpu = pd.pivot_table(servers, index=["region", "vpc", "zone", "resource_group_name", "instance_profile"],
                                     columns=["month"],
                                     values=["instance_id", "cost"],
@@ -1350,33 +1515,39 @@ def createVirtualServerTab(servers):
 
     new_order = ["instance_count", "vCPU", "memoryMiB", "cost"]
     vcpu = vcpu.reindex(new_order, axis=1, level=0)
-    vcpu.to_excel(writer, sheet_name='VirtualServerSummary',startrow=2)
-    worksheet = writer.sheets['VirtualServerSummary']
-    boldtext = workbook.add_format({'bold': True})
+    return vcpu, len(servers.month.unique())
+def createVirtualServerTab(vcpu, months):
+    """
+    Write VPC Virtual Server Summary tab
+    """
+
+    logging.info("Creating VPC Virtual Server Summary Tab.")
+
+    worksheet = workbook.add_worksheet('VirtualServerSummary')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
+    vcpu.to_excel(writer, sheet_name='VirtualServerSummary',startrow=2)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:C", 15, format2)
     worksheet.set_column("D:E", 25, format2)
     # Calculate and format Cost Columns by month
-    months = len(servers.month.unique())
     startcol = 5
     endcol = startcol + months
     worksheet.set_column(startcol, endcol, 10, format3)
     worksheet.set_column(endcol + 1, endcol + 2 + months, 15, format1)
 
     return
-def createBMServerTab(servers):
+def getBMServerPivot(servers):
     """
-    Create BM SUmmary region, vpc, zone and profile
+    Create BM SUmmary region, vpc, zone and profile, None if there are no bare metal servers
     """
 
-    logging.info("Creating Bare Metal Summary Tab.")
     servers = servers.query('service_id == "is.bare-metal-server"')
 
     if len(servers) == 0:
-        return
+        return None
     vcpu = pd.pivot_table(servers, index=["region", "vpc", "zone", "resource_group_name", "instance_profile"],
                                     columns=["month"],
                                     values=["instance_id", "cost"],
@@ -1386,29 +1557,32 @@ def createBMServerTab(servers):
 
     new_order = ["instance_count",  "cost"]
     vcpu = vcpu.reindex(new_order, axis=1, level=0)
-    vcpu.to_excel(writer, 'BMServerSummary',startrow=2)
-    worksheet = writer.sheets['BMServerSummary']
-    boldtext = workbook.add_format({'bold': True})
+    return vcpu, len(servers.month.unique())
+def createBMServerTab(vcpu, months):
+    """
+    Write Bare Metal Summary tab
+    """
+
+    logging.info("Creating Bare Metal Summary Tab.")
+    worksheet = workbook.add_worksheet('BMServerSummary')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
+    vcpu.to_excel(writer, 'BMServerSummary',startrow=2)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:C", 15, format2)
     worksheet.set_column("D:E", 30, format2)
     # Calculate and format Cost Columns by month
-    months = len(servers.month.unique())
     startcol = 5
     endcol = startcol + months
     worksheet.set_column(startcol, endcol, 10, format3)
     worksheet.set_column(endcol + 1 , endcol + 2 + months, 15, format1)
     return
-def createVolumeSummary(volumes):
+def getVolumeSummaryPivot(volumes):
     """
     Create BM VCPU deployed by role, account, and az
     """
-
-    logging.info("Creating Block Volume Summary tab.")
-
     pivot = pd.pivot_table(volumes, index=["region", "zone", "resource_group_name", "volume_iops", "volume_capacity"],
                                     columns=["month"],
                                     values=["instance_id", "cost"],
@@ -1418,30 +1592,34 @@ def createVolumeSummary(volumes):
 
     new_order = ["instance_count",  "cost"]
     pivot = pivot.reindex(new_order, axis=1, level=0)
-    pivot.to_excel(writer, sheet_name='VolumesSummary', startrow=2)
-    worksheet = writer.sheets['VolumesSummary']
-    boldtext = workbook.add_format({'bold': True})
+    return pivot, len(volumes.month.unique())
+def createVolumeSummary(pivot, months):
+    """
+    Write Block Volume Summary tab
+    """
+
+    logging.info("Creating Block Volume Summary tab.")
+
+    worksheet = workbook.add_worksheet('VolumesSummary')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
-    format4 = workbook.add_format({'num_format': '$#,##0.00'})
+    pivot.to_excel(writer, sheet_name='VolumesSummary', startrow=2)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
+    format4 = reportWriter.getFormat(workbook, "currency")
     worksheet.set_column("A:B", 15, format2)
     worksheet.set_column("C:E", 30, format2)
     # Calculate and format Cost Columns by month
-    months = len(volumes.month.unique())
     startcol = 5
     endcol = startcol + months
     worksheet.set_column(startcol, endcol, 10, format3)
     worksheet.set_column(endcol + 1 , endcol + 2 + months, 15, format1)
     return
-def createkubernetesTab(workers):
+def getkubernetesPivot(workers):
     """
     Create BM SUmmary region, vpc, zone and profile
     """
-
-    logging.info("Creating Kubernetes Summary Tab.")
-
     pivot = pd.pivot_table(workers, index=["region", "vpc", "cluster_name", "worker_pool", "worker_name", "zone", "worker_flavor", "created_by_name", "instance_state"],
                                     columns=["month"],
                                     values=["cost"],
@@ -1451,13 +1629,21 @@ def createkubernetesTab(workers):
 
     new_order = ["cost"]
     pivot = pivot.reindex(new_order, axis=1, level=0)
-    pivot.to_excel(writer, sheet_name='KubernetesSummary',startrow=2)
-    worksheet = writer.sheets['KubernetesSummary']
-    boldtext = workbook.add_format({'bold': True})
+    return pivot, len(workers.month.unique())
+def createkubernetesTab(pivot, months):
+    """
+    Write Kubernetes Summary tab
+    """
+
+    logging.info("Creating Kubernetes Summary Tab.")
+
+    worksheet = workbook.add_worksheet('KubernetesSummary')
+    boldtext = reportWriter.getFormat(workbook, "bold")
     worksheet.write(0, 0, "Current month to date usage as of {}".format(runtimestamp),boldtext)
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
-    format3 = workbook.add_format({'num_format': '#,##0'})
+    pivot.to_excel(writer, sheet_name='KubernetesSummary',startrow=2)
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
+    format3 = reportWriter.getFormat(workbook, "count")
     worksheet.set_column("A:A", 12, format2)
     worksheet.set_column("B:B", 25, format2)
     worksheet.set_column("C:D", 25, format2)
@@ -1466,7 +1652,6 @@ def createkubernetesTab(workers):
     worksheet.set_column("H:H", 25, format2)
     worksheet.set_column("I:I", 15, format3)
     # Calculate and format Cost Columns by month
-    months = len(workers.month.unique())
     startcol = 9
     endcol = startcol + months
     worksheet.set_column(startcol, endcol, 10, format1)
@@ -1484,8 +1669,8 @@ def createUserTab(user_cache):
     users = pd.DataFrame.from_records(users, columns=["iam_id","firstname","lastname","state","email","role","org","geo","market","added_on","invitedOn"])
     users.to_excel(writer,  sheet_name="Users")
     worksheet = writer.sheets['Users']
-    format1 = workbook.add_format({'num_format': '$#,##0.00'})
-    format2 = workbook.add_format({'align': 'left'})
+    format1 = reportWriter.getFormat(workbook, "currency")
+    format2 = reportWriter.getFormat(workbook, "left")
     worksheet.set_column("A:A", 5, format2)
     worksheet.set_column("B:B", 35, format2)
     worksheet.set_column("C:D", 25, format2)
@@ -1583,14 +1768,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Calculate IBM Cloud Usage.")
     parser.add_argument("--apikey", default=os.environ.get('IC_API_KEY', None), metavar="apikey", help="IBM Cloud API Key")
     parser.add_argument("--output", default=os.environ.get('output', 'ibmCloudUsage.xlsx'), help="Filename Excel output file. (including extension of .xlsx)")
-    parser.add_argument("--load", action=argparse.BooleanOptionalAction, help="load dataframes from pkl files for testing purposes.")
-    parser.add_argument("--save", action=argparse.BooleanOptionalAction, help="Store dataframes to pkl files for testing purposes.")
+    parser.add_argument("--format", default=os.environ.get('format', 'xlsx'), choices=["xlsx", "parquet", "csv"], help="Format of detail data, parquet or csv write the detail tabs to separate files named after the output file.")
+    parser.add_argument("--load", action=argparse.BooleanOptionalAction, help="load months requested from accountUsage.parquet and instancesUsage.parquet stores.")
+    parser.add_argument("--save", action=argparse.BooleanOptionalAction, help="Save usage to accountUsage.parquet and instancesUsage.parquet stores partitioned by month.")
     parser.add_argument("--months", default=os.environ.get('months', 1), help="Number of months including current month to include in report.")
     parser.add_argument("--vpc", action=argparse.BooleanOptionalAction, help="Include additional VPC analysis tabs.")
     parser.add_argument("--detail", action=argparse.BooleanOptionalAction, help="Include service usage detail tabs.")
     parser.add_argument("--cosinstances", action=argparse.BooleanOptionalAction, help="Include additional COS Instance Detail.")
     parser.add_argument("--kubernetes", action=argparse.BooleanOptionalAction, help="Include additional Kube Cluster Detail.")
     parser.add_argument("--users", action=argparse.BooleanOptionalAction, help="Include tab with details on users in account.")
+    parser.add_argument("--workers", default=os.environ.get('workers', 4), help="Number of concurrent workers used to retrieve monthly usage.")
+    parser.add_argument("--pivot-workers", default=os.environ.get('pivot_workers', None), help="Number of processes used to compute report pivots, defaults to the number of CPUs.  1 computes them in process.")
+    parser.add_argument("--streaming-xlsx", action=argparse.BooleanOptionalAction, help="Write Excel file in constant memory mode, detail rows beyond the Excel row limit continue on additional tabs.")
     parser.add_argument("-s", "--startdate", default=os.environ.get('startdate', None), help="Start Year & Month in format YYYY-MM")
     parser.add_argument("-e", "--enddate", default=os.environ.get('enddate', None), help="End Year & Month in format YYYY-MM")
     parser.add_argument("--cos", "--COS", action=argparse.BooleanOptionalAction, help="Write output to COS bucket destination specified.")
@@ -1604,6 +1793,7 @@ if __name__ == "__main__":
     parser.add_argument("--sendGridFrom", default=os.environ.get('sendGridFrom', None), help="Sendgrid from email to send output from.")
     parser.add_argument("--sendGridSubject", default=os.environ.get('sendGridSubject', None), help="SendGrid email subject for output email")
     args = parser.parse_args()
+    workers = int(args.workers)
 
     """
     Parse Date Parameters
@@ -1619,10 +1809,28 @@ if __name__ == "__main__":
         startdate = datetime.strptime(args.startdate, "%Y-%m")
         enddate = datetime.strptime(args.enddate, "%Y-%m")
 
+    timestamp = datetime.now(timezone.utc)
+    runtimestamp = timestamp.strftime("%H:%M UTC on %b %d, %Y")
+    filetimestamp = "_{}".format(timestamp.strftime("%Y%m%d_%H%M"))
+
     if args.load:
         logging.info("Retrieving Usage and Instance data stored data")
-        accountUsage = pd.read_pickle("accountUsage.pkl")
-        instancesUsage = pd.read_pickle("instanceUsage.pkl")
+        """ only read the months requested and the columns used by the tabs requested """
+        if args.detail:
+            accountColumns = None
+            instancesColumns = None
+        else:
+            accountColumns = ["month", "resource_name", "plan_name", "metric", "quantity", "cost"]
+            instancesColumns = {"month", "service_id", "service_name", "cost"}
+            if args.vpc:
+                instancesColumns.update(["region", "vpc", "zone", "resource_group_name", "instance_profile", "instance_id", "instance_name",
+                                         "created_by_name", "provision_date", "deprovision_date", "instance_state", "volume_iops", "volume_capacity"])
+            if args.cosinstances:
+                instancesColumns.update(["region", "resource_group_name", "instance_name", "plan_name", "metric", "unit", "quantity"])
+            if args.kubernetes:
+                instancesColumns.update(["region", "vpc", "cluster_name", "worker_pool", "worker_name", "zone", "worker_flavor", "created_by_name", "instance_state"])
+        accountUsage = usageStore.loadUsage("accountUsage.parquet", "month", startdate.strftime("%Y-%m"), enddate.strftime("%Y-%m"), accountColumns)
+        instancesUsage = usageStore.loadUsage("instancesUsage.parquet", "month", startdate.strftime("%Y-%m"), enddate.strftime("%Y-%m"), instancesColumns)
     else:
         if args.apikey == None:
             logging.error("You must provide IBM Cloud ApiKey with view access to usage reporting.")
@@ -1633,9 +1841,6 @@ if __name__ == "__main__":
             accountUsage = pd.DataFrame()
             createSDK(apikey)
             accountId = getAccountId(apikey)
-            timestamp = datetime.now(timezone.utc)
-            runtimestamp = timestamp.strftime("%H:%M UTC on %b %d, %Y")
-            filetimestamp = "_{}".format(timestamp.strftime("%Y%m%d_%H%M"))
             logging.info("Running IBM Cloud Usage Report for AccountId: {} at {}.".format(accountId,runtimestamp))
             """
             Pre-populate Account Data to accelerate report generation
@@ -1646,7 +1851,8 @@ if __name__ == "__main__":
             """
             Pre-populate Configuration data on VPC and Clusters (requires Viewer access of VPC and Kubernetes clusters)
             """
-            image_cache = {}
+            image_cache = populateImageCache()
+            bm_initialization_cache = {}
             vpc_instance_cache = populateVPCInstanceCache()
             cluster_cache, worker_cache = populateClusterCache()
             logging.info("Retrieving Usage and Instance data from AccountId: {}.".format(accountId))
@@ -1656,22 +1862,21 @@ if __name__ == "__main__":
             instancesUsage = pd.concat([instancesUsage, getInstancesUsage(startdate, enddate)])
 
             if args.save:
-                accountUsage.to_pickle("accountUsage.pkl")
-                instancesUsage.to_pickle("instanceUsage.pkl")
+                usageStore.saveUsage(accountUsage, "accountUsage.parquet", "month")
+                usageStore.saveUsage(instancesUsage, "instancesUsage.parquet", "month")
 
 
     """
     Write Dataframe to Excel Tabs (sheets)
     """
-    writer = pd.ExcelWriter(args.output, engine='xlsxwriter')
-    workbook = writer.book
-    if args.detail:
-        createServiceDetail(accountUsage)
-        createInstancesDetailTab(instancesUsage)
-
+    """
+    Compute the pivots for all requested tabs in a process pool, only the record selection is done here so each worker
+    receives just the records its pivot needs.  The workbook is then written serially in the original tab order.
+    """
+    tasks = {}
     if len(accountUsage) > 0:
-        createUsageSummaryTab(accountUsage)
-        createMetricSummary(accountUsage)
+        tasks["UsageSummary"] = (getUsageSummaryPivot, (accountUsage,))
+        tasks["MetricPlanSummary"] = (getMetricSummaryPivot, (accountUsage,))
 
     if args.vpc and len(instancesUsage) > 0:
         """
@@ -1680,27 +1885,56 @@ if __name__ == "__main__":
         servers = instancesUsage.query('service_id == "is.instance" or service_id == "is.bare-metal-server"')
         storage = instancesUsage.query('service_id == "is.volume"')
 
-        months = instancesUsage.month.unique()
-
         """ create VPC Virtual Server & BM Server detail"""
         if len(servers) > 0:
-            createVirtualServerTab(servers)
-            createBMServerTab(servers)
-            createServerProvisioningTab(servers)
+            tasks["VirtualServerSummary"] = (getVirtualServerPivot, (servers,))
+            tasks["BMServerSummary"] = (getBMServerPivot, (servers,))
+            tasks["ServersByUser"] = (getServerProvisioningPivot, (servers,))
         if len(storage) > 0:
-            createVolumeSummary(storage)
+            tasks["VolumesSummary"] = (getVolumeSummaryPivot, (storage,))
     if args.cosinstances and len(instancesUsage) > 0:
         """
         Create COS Detail tab
         """
         cos = instancesUsage.query('service_name == "Cloud Object Storage"')
         if len(cos) > 0:
-            createChargesCOSInstance(cos)
+            tasks["COSBuckets"] = (getChargesCOSInstancePivot, (cos,))
 
     if args.kubernetes and len(instancesUsage) > 0:
-        workers = instancesUsage.query('service_id == "containers-kubernetes"')
-        if len(workers) > 0:
-            createkubernetesTab(workers)
+        kubernetesWorkers = instancesUsage.query('service_id == "containers-kubernetes"')
+        if len(kubernetesWorkers) > 0:
+            tasks["KubernetesSummary"] = (getkubernetesPivot, (kubernetesWorkers,))
+
+    pivots = reportWriter.computePivots(tasks, int(args.pivot_workers) if args.pivot_workers != None else None)
+
+    writer = reportWriter.createExcelWriter(args.output, args.streaming_xlsx)
+    workbook = writer.book
+    detailFiles = []
+    if args.detail:
+        if args.format == "xlsx":
+            createServiceDetail(accountUsage)
+            createInstancesDetailTab(instancesUsage)
+        else:
+            detailFiles.append(reportWriter.writeDetailFile(accountUsage, args.output, "ServiceUsageDetail", args.format))
+            detailFiles.append(reportWriter.writeDetailFile(instancesUsage, args.output, "Instances_Detail", args.format))
+
+    if "UsageSummary" in pivots:
+        createUsageSummaryTab(pivots["UsageSummary"])
+        createMetricSummary(*pivots["MetricPlanSummary"])
+
+    if "VirtualServerSummary" in pivots:
+        createVirtualServerTab(*pivots["VirtualServerSummary"])
+        if pivots["BMServerSummary"] is not None:
+            createBMServerTab(*pivots["BMServerSummary"])
+        createServerProvisioningTab(pivots["ServersByUser"])
+    if "VolumesSummary" in pivots:
+        createVolumeSummary(*pivots["VolumesSummary"])
+
+    if "COSBuckets" in pivots:
+        createChargesCOSInstance(*pivots["COSBuckets"])
+
+    if "KubernetesSummary" in pivots:
+        createkubernetesTab(*pivots["KubernetesSummary"])
 
     if args.users:
         createUserTab(user_cache)
@@ -1727,5 +1961,8 @@ if __name__ == "__main__":
                                  endpoint_url=args.COS_ENDPOINT
                                  )
         multi_part_upload(args.COS_BUCKET, file_name + filetimestamp + ".xlsx", "./" + args.output)
+        for detailFile in detailFiles:
+            detail_name, detail_ext = os.path.splitext(detailFile)
+            multi_part_upload(args.COS_BUCKET, detail_name + filetimestamp + detail_ext, "./" + detailFile)
 
     logging.info("Usage Report generation of {} file is complete.".format(args.output))
\ No newline at end of file
@@ -15,7 +15,8 @@
 
 
 __author__ = 'jonhall'
-import SoftLayer, os, logging, logging.config, json, calendar, os.path, argparse, base64, re, urllib, yaml, strip_markdown
+import SoftLayer, os, sys, logging, logging.config, json, calendar, os.path, argparse, base64, re, urllib, yaml, strip_markdown, gzip
+import concurrent.futures, collections, threading, time
 import pandas as pd
 import numpy as np
 from sendgrid import SendGridAPIClient
@@ -34,6 +35,52 @@ from ibm_cloud_sdk_core import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from dotenv import load_dotenv
 from yaml import Loader
+import usageStore
+import usageDescription
+import reportWriter
+import softlayerApi
+
+# classicUsage columns with few distinct values, interned when rows are accumulated in getInvoiceDetail
+internColumns = {'Portal_Invoice_Date', 'Service_Date_Start', 'Service_Date_End', 'IBM_Invoice_Month', 'Type', 'RecordType', 'location',
+                 'Category_Group', 'Category', 'TaxCategory', 'dPart', 'Description', 'Memory', 'OS', 'Recurring_Description',
+                 'childParentCategory', 'childParentProduct', 'INV_PRODID', 'INV_DIV', 'PLAN_ID', 'FEATURE_ID',
+                 'IS_PRIVATE_NETWORK_ONLY', 'DUAL_PATH_NETWORK', 'INELIGIBLE_FOR_ACCOUNT_DISCOUNT'}
+
+# product attribute keyName to classicUsage column, child records get every column and parent records the d-code columns
+productAttributes = {"BLUEMIX_PART_NUMBER": "INV_PRODID",
+                     "BLUEMIX_SERVICE_PLAN_DIVISION": "INV_DIV",
+                     "BLUEMIX_SERVICE_PLAN_ID": "PLAN_ID",
+                     "BLUEMIX_SERVICE_PLAN_FEATURE_ID": "FEATURE_ID",
+                     "IS_PRIVATE_NETWORK_ONLY": "IS_PRIVATE_NETWORK_ONLY",
+                     "DUAL_PATH_NETWORK": "DUAL_PATH_NETWORK",
+                     "INELIGIBLE_FOR_ACCOUNT_DISCOUNT": "INELIGIBLE_FOR_ACCOUNT_DISCOUNT"}
+parentAttributeColumns = ["INV_PRODID", "INV_DIV", "PLAN_ID"]
+
+# adaptive invoice page size, pages grow while they return faster than pageTargetSeconds and smaller than pageTargetBytes
+# and are halved on timeouts or oversized responses.  Each invoice is split into ranges of rangePages pages at the page
+# size the invoice has adapted to when the range is submitted, ranges are retrieved in parallel.
+initialPageLimit = 75
+minPageLimit = 10
+maxPageLimit = 500
+pageTargetSeconds = 10
+pageTargetBytes = 4000000
+rangePages = 2
+# invoice ranges per worker submitted ahead of parsing, bounds the retrieved pages held in memory
+rangesPerWorker = 2
+invoicePageLimits = {}
+invoicePageSizes = {}
+pageLimitLock = threading.Lock()
+
+# classicUsage dtypes, low cardinality strings are categorical.  Amounts and rates stay float64 so totals reconcile to the cent
+classicUsageSchema = {'Portal_Invoice_Date': 'category', 'Portal_Invoice_Time': 'category', 'Service_Date_Start': 'category',
+                      'Service_Date_End': 'category', 'IBM_Invoice_Month': 'category', 'Type': 'category', 'RecordType': 'category',
+                      'location': 'category', 'Category_Group': 'category', 'Category': 'category', 'TaxCategory': 'category',
+                      'dPart': 'category', 'Description': 'category', 'Memory': 'category', 'OS': 'category',
+                      'Recurring_Description': 'category', 'childParentCategory': 'category', 'childParentProduct': 'category',
+                      'INV_PRODID': 'category', 'INV_DIV': 'category', 'PLAN_ID': 'category', 'FEATURE_ID': 'category',
+                      'IS_PRIVATE_NETWORK_ONLY': 'category', 'DUAL_PATH_NETWORK': 'category', 'INELIGIBLE_FOR_ACCOUNT_DISCOUNT': 'category',
+                      'Hourly': 'bool', 'Usage': 'bool', 'Hours': 'int32'}
+
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     # read logging.json for log parameters to be ued by script
     path = default_path
@@ -47,20 +94,24 @@ def setup_logging(default_path='logging.json', default_level=logging.info, env_k
     else:
         logging.basicConfig(level=default_level)
 
-def getDescription(categoryCode, detail):
+def getChildrenIndex(children):
+    # build map of categoryCode to first child record with that categoryCode so description lookups don't scan all children
+    childrenIndex = {}
+    for child in children:
+        if 'categoryCode' in child:
+            childrenIndex.setdefault(child['categoryCode'], child)
+    return childrenIndex
+
+def getDescription(categoryCode, childrenIndex):
     # retrieve additional description detail for child records
-    for item in detail:
-        if 'categoryCode' in item:
-            if item['categoryCode'] == categoryCode:
-                return item['product']['description'].strip()
+    if categoryCode in childrenIndex:
+        return childrenIndex[categoryCode]['product']['description'].strip()
     return ""
 
-def getStorageServiceUsage(categoryCode, detail):
+def getStorageServiceUsage(categoryCode, childrenIndex):
     # retrieve storage details for description text
-    for item in detail:
-        if 'categoryCode' in item:
-            if item['categoryCode'] == categoryCode:
-                return item['description'].strip()
+    if categoryCode in childrenIndex:
+        return childrenIndex[categoryCode]['description'].strip()
     return ""
 
 def getCFTSInvoiceDate(invoiceDate):
@@ -93,7 +144,7 @@ def getAccountDetail():
     """
     logging.info("Getting IMS Account {} Detail.".format(ims_account))
     try:
-        account = client['Account'].getObject(id=ims_account, mask="id, companyName, country, email, accountStatus, billingInfo, bluemixAccountId, brand, datacentersWithSubnetAllocations, bluemixAccountLink, internalNotes,masterUser, proofOfConceptAccountFlag")
+        account = softlayerApi.callAPI(client, 'Account', 'getObject', id=ims_account, mask="id, companyName, country, email, accountStatus, billingInfo, bluemixAccountId, brand, datacentersWithSubnetAllocations, bluemixAccountLink, internalNotes,masterUser, proofOfConceptAccountFlag")
     except SoftLayer.SoftLayerAPIError as e:
         logging.error("Account::getObject: %s, %s" % (e.faultCode, e.faultString))
         quit(1)
@@ -143,7 +194,7 @@ def getUsers():
     """
     logging.info("Getting IMS account {} users.".format(ims_account))
     try:
-        userList = client['Account'].getUsers(id=ims_account, mask='id,accountId, companyName, createDate, displayName, firstName, lastName, email, iamId, isMasterUserFlag, managedByOpenIdConnectFlag, modifyDate,'
+        userList = softlayerApi.callAPI(client, 'Account', 'getUsers', id=ims_account, mask='id,accountId, companyName, createDate, displayName, firstName, lastName, email, iamId, isMasterUserFlag, managedByOpenIdConnectFlag, modifyDate,'
                                                                    ' openIdConnectUserName, sslVpnAllowedFlag, statusDate, username, userStatus, loginAttempts')
     except SoftLayer.SoftLayerAPIError as e:
         logging.error("Account::getUsers: %s, %s" % (e.faultCode, e.faultString))
@@ -209,7 +260,7 @@ def getInvoiceList(startdate, enddate):
     logging.debug("invoiceList startDate: {}".format(startdate.astimezone(dallas).strftime("%m/%d/%Y %H:%M:%S")))
     logging.debug("invoiceList endDate: {}".format(enddate.astimezone(dallas).strftime("%m/%d/%Y %H:%M:%S")))
     try:
-        invoiceList = client['Account'].getInvoices(id=ims_account, mask='id,accountId,createDate,typeCode,invoiceTotalAmount,invoiceTotalRecurringAmount,invoiceTopLevelItemCount', filter={
+        invoiceList = softlayerApi.callAPI(client, 'Account', 'getInvoices', id=ims_account, mask='id,accountId,createDate,typeCode,invoiceTotalAmount,invoiceTotalRecurringAmount,invoiceTopLevelItemCount', filter={
                 'invoices': {
                     'createDate': {
                         'operation': 'betweenDate',
@@ -228,6 +279,32 @@ def getInvoiceList(startdate, enddate):
         logging.info("IBM Cloud account {}".format(invoiceList[0]["accountId"]))
     return invoiceList
 
+def addRow(row):
+    """
+    Append row to the columnar accumulator used to build the classicUsage dataframe.
+    Values are appended to one list per column instead of copying the row dict, and repeated
+    low cardinality strings are interned so every row references the same string object.
+    """
+    for column, values in data.items():
+        value = row.get(column, np.nan)
+        if column in internColumns and type(value) is str:
+            value = sys.intern(value)
+        values.append(value)
+    return
+
+def getProductAttributes(product, columns=productAttributes.values()):
+    """
+    Map product attributes to classicUsage columns with a single lookup per attribute in productAttributes.
+    Requested columns without a matching attribute are returned as "".
+    """
+    attributes = dict.fromkeys(columns, "")
+    if "attributes" in product:
+        for attr in product["attributes"]:
+            column = productAttributes.get(attr["attributeType"]["keyName"])
+            if column in attributes:
+                attributes[column] = attr["value"]
+    return attributes
+
 def parseChildren(row, parentCategory, parentDescription, children):
     """
     Parse Children Record if requested
@@ -254,61 +331,17 @@ def parseChildren(row, parentCategory, parentDescription, children):
             else:
                 row["Category_group"] = child['category']['name']
             if row["Category_Group"] == "StorageLayer":
-                desc = child["description"].find(":")
-                if desc == -1:
-                    row["Description"] = child["description"]
-                    row["childUsage"] = ""
-                else:
-                    # Parse usage details from child description for StorageLayer
-                    row["Description"] = child["description"][0:desc]
-                    if child["description"].find("API Requests") != -1:
-                        row['childUsage'] = float(re.search("\d+", child["description"][desc:]).group())
-                    elif child["description"].find("Snapshot Space") != -1:
-                            row['childUsage'] = float(re.search("\d+", child["description"][desc:]).group())
-                    elif child["description"].find("Replication for tier") != -1:
-                            row['childUsage'] = 0
-                    else:
-                            row['childUsage'] = float(re.search("\d+([\.,]\d+)", child["description"][desc:]).group())
+                row["Description"], row["childUsage"] = usageDescription.parseStorageLayerDescription(child["description"])
             else:
-                desc = child["description"].find("- $")
-                if desc == -1:
-                    row["Description"] = child["description"]
-                    row["childUsage"] = ""
-                else:
-                    # Parse usage details from child description
-                    row["Description"] = child["description"][0:desc]
-                    row['childUsage'] = re.search("([\d.]+)\s+(\S+)", child["description"][desc:]).group()
-                    row['childUsage'] = float(row['childUsage'][0:row['childUsage'].find("Usage") - 3])
+                row["Description"], row["childUsage"] = usageDescription.parseUsageDescription(child["description"])
             row["totalRecurringCharge"] = 0
             row["childTotalRecurringCharge"] = round(float(child["recurringFee"]), 3)
 
             # Get product attributes for PaaS Product Code and DIV
-            row["INV_PRODID"] = ""
-            row["INV_DIV"] = ""
-            row["PLAN_ID"] = ""
-            row["FEATURE_ID"] = ""
-            row["IS_PRIVATE_NETWORK_ONLY"] = ""
-            row["DUAL_PATH_NETWORK"] = ""
-            row["INELIGIBLE_FOR_ACCOUNT_DISCOUNT"] = ""
-            if "attributes" in child["product"]:
-                for attr in child["product"]["attributes"]:
-                    if attr["attributeType"]["keyName"] == "BLUEMIX_PART_NUMBER":
-                        row["INV_PRODID"] = attr["value"]
-                    if attr["attributeType"]["keyName"] == "BLUEMIX_SERVICE_PLAN_DIVISION":
-                        row["INV_DIV"] = attr["value"]
-                    if attr["attributeType"]["keyName"] == "BLUEMIX_SERVICE_PLAN_ID":
-                        row["PLAN_ID"] = attr["value"]
-                    if attr["attributeType"]["keyName"] == "BLUEMIX_SERVICE_PLAN_FEATURE_ID":
-                        row["FEATURE_ID"] = attr["value"]
-                    if attr["attributeType"]["keyName"] == "IS_PRIVATE_NETWORK_ONLY":
-                        row["IS_PRIVATE_NETWORK_ONLY"] = attr["value"]
-                    if attr["attributeType"]["keyName"] == "DUAL_PATH_NETWORK":
-                        row["DUAL_PATH_NETWORK"] = attr["value"]
-                    if attr["attributeType"]["keyName"] == "INELIGIBLE_FOR_ACCOUNT_DISCOUNT":
-                        row["INELIGIBLE_FOR_ACCOUNT_DISCOUNT"] = attr["value"]
+            row.update(getProductAttributes(child["product"]))
 
             # write child record
-            data.append(row.copy())
+            addRow(row)
             logging.debug("child {} {} {} RecurringFee: {}".format(row["childBillingItemId"], row["INV_PRODID"], row["Description"],
                                                                row["childTotalRecurringCharge"]))
             logging.debug(row)
@@ -316,16 +349,85 @@ def parseChildren(row, parentCategory, parentDescription, children):
 
 def getAccountNetworkStorage():
     """
-    Build Dataframe with accounts current network storage
+    Build Dataframe with accounts current network storage and an index of storage notes keyed by billingItemId
+    Network storage is retrieved in pages so large accounts are not returned in a single XML-RPC response, and
+    rows are collected in a list so the dataframe is only built once.
     """
     logging.info("Getting details on existing Network Storage in account.")
-    try:
-        networkStorage = client['Account'].getNetworkStorage(id=ims_account, mask="id, createDate, capacityGb, nasType, notes, username, provisionedIops, billingItem.id")
-    except Exception as e:
-        logging.error("Account::getNetworkStorage {}, {}".format(e.faultCode, e.faultString))
-        quit(1)
+    limit = 500 ## set limit of record returned
+    offset = 0
+    data = []
+    while True:
+        logging.info("Retrieving Network Storage for account at Offset {}.".format(offset))
+        try:
+            networkStorage = softlayerApi.callAPI(client, 'Account', 'getNetworkStorage', id=ims_account, limit=limit, offset=offset, mask="id, createDate, capacityGb, nasType, notes, username, provisionedIops, billingItem.id")
+        except SoftLayer.SoftLayerAPIError as e:
+            logging.error("Account::getNetworkStorage {}, {}".format(e.faultCode, e.faultString))
+            quit(1)
+
+        for item in networkStorage:
+            if 'billingItem' in item:
+                if 'id' in item['billingItem']:
+                    billingItemId = item['billingItem']['id']
+                else:
+                    billingItemId = ""
+            else:
+                billingItemId = ""
+
+            if 'createDate' in item:
+                createDate = item['createDate']
+            else:
+                createDate = ""
+
+            if 'capacityGb' in item:
+                capacityGb = item['capacityGb']
+            else:
+                capacityGb = ""
+
+            if 'nasType' in item:
+                nasType = item['nasType']
+            else:
+                nasType = ""
+
+            if 'notes' in item:
+                notes = urllib.parse.unquote(item['notes'])
+            else:
+                notes = ""
+
+            if 'username' in item:
+                username = item['username']
+            else:
+                username = ""
+
+            if 'provisionedIops' in item:
+                provisionedIops = item['provisionedIops']
+                if float(capacityGb) > 0:
+                    iopsTier = round(float(provisionedIops)/float(capacityGb),0)
+                else:
+                    iopsTier = ""
+            else:
+                provisionedIops = ""
+                iopsTier = ""
+
+            row = {
+                'id': item['id'],
+                'billingItemId': billingItemId,
+                'createDate': createDate,
+                'capacityGb': capacityGb,
+                'nasType': nasType,
+                'notes': notes,
+                'username': username,
+                'provisionedIops': provisionedIops,
+                'iopsTier': iopsTier
+                }
+
+            data.append(row)
 
-    storage_df = pd.DataFrame(columns=[
+        if len(networkStorage) < limit:
+            break
+        offset = offset + limit
+
+    storage_df = pd.DataFrame(data, columns=[
                                'id',
                                'billingItemId',
                                'createDate',
@@ -336,73 +438,238 @@ def getAccountNetworkStorage():
                                'provisionedIops',
                                'iopsTier',
                                ])
-    for item in networkStorage:
-        if 'billingItem' in item:
-            if 'id' in item['billingItem']:
-                billingItemId = item['billingItem']['id']
-            else:
-                billingItemId = ""
-        else:
-            billingItemId = ""
 
-        if 'createDate' in item:
-            createDate = item['createDate']
-        else:
-            createDate = ""
+    """ index notes by billingItemId so invoice items can be matched with a single lookup """
+    storage_index = storage_df.query('billingItemId != ""').drop_duplicates(subset="billingItemId", keep="first")
+    storage_notes = dict(zip(storage_index["billingItemId"], storage_index["notes"]))
 
-        if 'capacityGb' in item:
-            capacityGb = item['capacityGb']
-        else:
-            capacityGb = ""
+    return storage_df, storage_notes
 
-        if 'nasType' in item:
-            nasType = item['nasType']
-        else:
-            nasType = ""
-
-        if 'notes' in item:
-            notes = urllib.parse.unquote(item['notes'])
-        else:
-            notes = ""
-
-        if 'username' in item:
-            username = item['username']
-        else:
-            username = ""
+def getInvoiceMask(invoiceDate):
+    """
+    Return object mask to use for invoice top level items based on invoice date
+    """
+    dallas = tz.gettz('US/Central')
+    if invoiceDate < datetime(year=2023,month=5,day=1,hour=0,minute=0).astimezone(dallas):
+        """ if invoice date before May 2023, don't query dPart for toplevel and children """
+        mask = "id,billingItemId,categoryCode,category,category.group,hourlyFlag,hostName,domainName,location,notes,product.description,product.taxCategory,product.attributes.attributeType," \
+                    "createDate,totalRecurringAmount,totalOneTimeAmount,usageChargeFlag,hourlyRecurringFee,children.billingItemId,children.description,children.category.group," \
+                    "children.categoryCode,children.product,children.product.taxCategory,children.product.attributes,children.product.attributes.attributeType,children.recurringFee"
+    else:
+        """ if invoice date after April 2023 query dPart for toplevel and children """
+        mask = "id,billingItemId,categoryCode,category,category.group,hourlyFlag,hostName,domainName,location,notes,product.description,product.taxCategory,product.attributes.attributeType," \
+                    "createDate,totalRecurringAmount,totalOneTimeAmount,usageChargeFlag,hourlyRecurringFee,children.billingItemId,children.description,children.category.group," \
+                    "children.categoryCode,children.product,children.product.taxCategory,children.product.attributes,children.product.attributes.attributeType,children.recurringFee"
+    return mask
 
-        if 'provisionedIops' in item:
-            provisionedIops = item['provisionedIops']
-            if float(capacityGb) > 0:
-                iopsTier = round(float(provisionedIops)/float(capacityGb),0)
-            else:
-                iopsTier = ""
-        else:
-            provisionedIops = ""
-            iopsTier = ""
+def getInvoiceTopLevelItems(invoiceID, limit, offset, totalItems, mask):
+    """
+    Retrieve one page of invoice top level items.  Timeouts and oversized responses are not retried while the page
+    can still be made smaller so getInvoiceItemRange can retry with a smaller page.
+    """
+    logging.info("Retrieving %s invoice line items for Invoice %s at Offset %s of %s" % (limit, invoiceID, offset, totalItems))
+    Billing_Invoice = softlayerApi.callAPI(client, 'Billing_Invoice', 'getInvoiceTopLevelItems', id=invoiceID, limit=limit, offset=offset, mask=mask,
+                                           giveUp=isPageSizeFault if limit > minPageLimit else None)
+    return Billing_Invoice
 
-        row = pd.DataFrame({
-                            'id': [item['id']],
-                            'billingItemId': [billingItemId],
-                            'createDate': [createDate],
-                            'capacityGb': [capacityGb],
-                            'nasType': [nasType],
-                            'notes': [notes],
-                            'username': [username],
-                            'provisionedIops': [provisionedIops],
-                            'iopsTier': [iopsTier]
-                            })
+def isPageSizeFault(e):
+    """
+    Return True if the API error is a timeout or oversized response that may succeed with a smaller page
+    """
+    if isinstance(e, SoftLayer.TransportError) and e.faultCode in [0, 500, 502, 503, 504]:
+        return True
+    faultString = str(e.faultString).lower()
+    return any(reason in faultString for reason in ["timed out", "timeout", "too large", "memory"])
 
-        storage_df = pd.concat([storage_df, row], ignore_index=True)
+def getPageBytes(items):
+    """
+    Estimate the response size of a page of top level items without serializing the page again, the size per record
+    (item and children) of the first, middle and last items is scaled by the number of records on the page.
+    """
+    if len(items) == 0:
+        return 0
+    records = len(items) + sum(len(item.get("children", [])) for item in items)
+    samples = [items[0], items[len(items) // 2], items[-1]]
+    sampleRecords = sum(1 + len(item.get("children", [])) for item in samples)
+    return sum(len(json.dumps(item)) for item in samples) * records // sampleRecords
+
+def getInvoiceItemRange(invoiceID, start, count, totalItems, mask):
+    """
+    Retrieve count top level items of an invoice starting at start with an adaptive page size shared by all ranges of
+    the invoice.  Returns the items retrieved and the offsets of pages that could not be retrieved so the failure only
+    affects those pages and not the whole run.
+    """
+    items = []
+    failedOffsets = []
+    offset = start
+    end = start + count
+    while offset < end:
+        with pageLimitLock:
+            limit = min(invoicePageLimits.setdefault(invoiceID, initialPageLimit), end - offset)
+        startTime = time.monotonic()
+        try:
+            Billing_Invoice = getInvoiceTopLevelItems(invoiceID, limit, offset, totalItems, mask)
+        except SoftLayer.SoftLayerAPIError as e:
+            if isPageSizeFault(e) and limit > minPageLimit:
+                with pageLimitLock:
+                    invoicePageLimits[invoiceID] = max(minPageLimit, min(invoicePageLimits[invoiceID], limit // 2))
+                logging.warning("Billing_Invoice::getInvoiceTopLevelItems: Invoice %s Offset %s: %s, %s.  Retrying with page size %s." %
+                                (invoiceID, offset, e.faultCode, e.faultString, invoicePageLimits[invoiceID]))
+                continue
+            logging.error("Billing_Invoice::getInvoiceTopLevelItems: Invoice %s Offset %s: %s, %s" % (invoiceID, offset, e.faultCode, e.faultString))
+            failedOffsets.append(offset)
+            offset = offset + limit
+            continue
+        elapsed = time.monotonic() - startTime
+        pageBytes = getPageBytes(Billing_Invoice)
+
+        with pageLimitLock:
+            invoicePageSizes.setdefault(invoiceID, []).append(limit)
+            if elapsed > pageTargetSeconds or pageBytes > pageTargetBytes:
+                invoicePageLimits[invoiceID] = max(minPageLimit, limit // 2)
+            elif elapsed < pageTargetSeconds / 2 and pageBytes < pageTargetBytes / 2 and limit == invoicePageLimits[invoiceID]:
+                invoicePageLimits[invoiceID] = min(maxPageLimit, limit * 2)
+        logging.debug("Invoice %s Offset %s: %s items in %.2f seconds, %s bytes." % (invoiceID, offset, len(Billing_Invoice), elapsed, pageBytes))
+
+        items.extend(Billing_Invoice)
+        offset = offset + limit
+    return items, failedOffsets
+
+def isInvoiceCached(invoice, mask):
+    """
+    Return True if the top level items of a closed invoice are in the invoice cache.  Invoice line items never change
+    once an invoice is created, the cache entry is only used if it was retrieved with the same object mask and contains
+    every top level item of the invoice.  Only the small header file is read, the items are read by readInvoiceCache
+    when the invoice is parsed.
+    """
+    cacheFile = os.path.join(cacheDir, "{}.json.gz".format(invoice['id']))
+    headerFile = os.path.join(cacheDir, "{}.header.json".format(invoice['id']))
+    if not os.path.exists(cacheFile) or not os.path.exists(headerFile):
+        return False
+    try:
+        with open(headerFile, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable invoice cache header {}: {}".format(headerFile, e))
+        return False
+    if header['mask'] != mask or header['itemCount'] != invoice['invoiceTopLevelItemCount']:
+        logging.info("Invoice cache for Invoice {} is out of date and will be refreshed.".format(invoice['id']))
+        return False
+    return True
+
+def readInvoiceCache(invoice):
+    """
+    Return cached top level items for an invoice, or None if the cache file can not be read.
+    """
+    cacheFile = os.path.join(cacheDir, "{}.json.gz".format(invoice['id']))
+    try:
+        with gzip.open(cacheFile, 'rt', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable invoice cache file {}: {}".format(cacheFile, e))
+        return None
+    if len(cached['items']) != invoice['invoiceTopLevelItemCount']:
+        logging.warning("Ignoring incomplete invoice cache file {}.".format(cacheFile))
+        return None
+    logging.info("Using cached line items for Invoice {}.".format(invoice['id']))
+    return cached['items']
+
+def writeInvoiceCache(invoice, mask, items):
+    """
+    Write the raw top level items of an invoice to the invoice cache as compressed json with a header file holding
+    the mask and item count, the header is written last so it only exists for a complete cache file.
+    """
+    os.makedirs(cacheDir, exist_ok=True)
+    cacheFile = os.path.join(cacheDir, "{}.json.gz".format(invoice['id']))
+    headerFile = os.path.join(cacheDir, "{}.header.json".format(invoice['id']))
+    header = {'invoiceId': invoice['id'],
+              'createDate': invoice['createDate'],
+              'invoiceTopLevelItemCount': invoice['invoiceTopLevelItemCount'],
+              'itemCount': len(items),
+              'mask': mask}
+    with gzip.open(cacheFile + ".tmp", 'wt', encoding='utf-8') as f:
+        json.dump(dict(header, items=items), f)
+    os.replace(cacheFile + ".tmp", cacheFile)
+    with open(headerFile + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(header, f)
+    os.replace(headerFile + ".tmp", headerFile)
+    logging.info("Cached {} line items for Invoice {}.".format(len(items), invoice['id']))
+    return
 
-    return storage_df
+def getServiceDates(serviceInvoiceDates, serviceMonths):
+    """
+    Calculate Service_Date_Start and Service_Date_End for all rows at once using month period arithmetic.
+    serviceMonths is the number of months prior to the invoice date the charges are for, the service period starts on
+    the same day of that month and ends on the last day of the month.  -1 is a service period of the invoice date only.
+    """
+    invoiceDates = pd.to_datetime(pd.Series(serviceInvoiceDates, dtype=object), format="%Y-%m-%d")
+    serviceMonths = pd.Series(serviceMonths, dtype=float)
+    period = invoiceDates.dt.to_period("M") - serviceMonths.clip(lower=0).fillna(0).astype(int)
+    day = np.minimum(invoiceDates.dt.day, period.dt.days_in_month)
+    serviceDateStart = period.dt.start_time + pd.to_timedelta(day - 1, unit="D")
+    serviceDateEnd = period.dt.end_time.dt.normalize().where(serviceMonths != -1, invoiceDates)
+    return serviceDateStart.dt.strftime("%Y-%m-%d").tolist(), serviceDateEnd.dt.strftime("%Y-%m-%d").tolist()
+
+def setClassicUsageSchema(classicUsage):
+    """
+    Apply classicUsageSchema dtypes to the columns present in classicUsage
+    """
+    return classicUsage.astype({column: dtype for column, dtype in classicUsageSchema.items() if column in classicUsage.columns})
 
 def getInvoiceDetail(startdate, enddate):
     """
     Read invoice top level detail from range of invoices
     """
-    global client, data, networkStorageDF
-    # Create dataframe to work with for classic infrastructure invoices
-    data = []
+    global client, data, networkStorageNotes
+    columns = ['Portal_Invoice_Date',
+               'Portal_Invoice_Time',
+               'Service_Date_Start',
+               'Service_Date_End',
+               'IBM_Invoice_Month',
+               'Portal_Invoice_Number',
+               'Type',
+               'RecordType',
+               'BillingItemId',
+               'hostName',
+               'location',
+               'Category_Group',
+               'Category',
+               'TaxCategory',
+               'dPart',
+               'Description',
+               'Memory',
+               'OS',
+               'billing_notes',
+               'Hourly',
+               'Usage',
+               'Hours',
+               'HourlyRate',
+               'totalRecurringCharge',
+               'NewEstimatedMonthly',
+               'totalOneTimeAmount',
+               'InvoiceTotal',
+               'InvoiceRecurring',
+               'Recurring_Description',
+               'childBillingItemId',
+               'childParentCategory',
+               'childParentProduct',
+               'childUsage',
+               'childTotalRecurringCharge',
+               'INV_PRODID',
+               'INV_DIV',
+               'PLAN_ID',
+               'FEATURE_ID',
+               'IS_PRIVATE_NETWORK_ONLY',
+               'DUAL_PATH_NETWORK',
+               'INELIGIBLE_FOR_ACCOUNT_DISCOUNT']
+    if storageFlag:
+        columns.append("storage_notes")
+
+    # Create columnar accumulator to build dataframe for classic infrastructure invoices, service dates are calculated
+    # for all rows after parsing from the invoice date and number of months prior to the invoice the charges are for
+    data = {column: [] for column in columns if column not in ["Service_Date_Start", "Service_Date_End"]}
+    data["serviceInvoiceDate"] = []
+    data["serviceMonths"] = []
 
     dallas = tz.gettz('US/Central')
 
@@ -412,13 +679,75 @@ def getInvoiceDetail(startdate, enddate):
     if invoiceList == None:
         return invoiceList
 
+    """
+    Retrieve invoice ranges in a bounded pool of workers so ranges from all invoices are retrieved at the same time,
+    each range is retrieved in pages sized by getInvoiceItemRange.  Ranges are parsed in invoice and offset order so the
+    row order of the output stays deterministic.  Only rangesPerWorker * workers ranges are submitted ahead of parsing,
+    the next range is submitted as each one is parsed so retrieved pages do not build up in memory.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    uncachedInvoices = []
+    pages = collections.deque()
+    cachedInvoices = set()
+    invoiceDates = {}
     for invoice in invoiceList:
         if (float(invoice['invoiceTotalAmount']) == 0) and (float(invoice['invoiceTotalRecurringAmount']) == 0):
             continue
-
-        invoiceID = invoice['id']
         # To align to CFTS billing cutoffs display time in Dallas timezone.
         invoiceDate = datetime.strptime(invoice['createDate'], "%Y-%m-%dT%H:%M:%S%z").astimezone(dallas)
+        mask = getInvoiceMask(invoiceDate)
+        invoiceDates[invoice['id']] = (invoiceDate, mask)
+        totalItems = invoice['invoiceTopLevelItemCount']
+        if cacheDir != None:
+            """ skip API calls for invoices already in the invoice cache """
+            if isInvoiceCached(invoice, mask):
+                cachedInvoices.add(invoice['id'])
+                continue
+        uncachedInvoices.append((invoice['id'], totalItems, mask))
+
+    def getInvoiceRanges():
+        """
+        Yield the ranges of each uncached invoice in parse order.  The range size is read when the range is submitted
+        so it follows the page size the invoice has adapted to, and a typical invoice is still split into several
+        ranges retrieved in parallel.
+        """
+        for invoiceID, totalItems, mask in uncachedInvoices:
+            offset = 0
+            while offset < totalItems:
+                with pageLimitLock:
+                    count = min(rangePages * invoicePageLimits.get(invoiceID, initialPageLimit), totalItems - offset)
+                yield invoiceID, offset, count, totalItems, mask
+                offset = offset + count
+
+    pendingRanges = getInvoiceRanges()
+
+    def submitNextRange():
+        """ submit the next invoice range in parse order to the pool """
+        nextRange = next(pendingRanges, None)
+        if nextRange != None:
+            pages.append((nextRange[0], executor.submit(getInvoiceItemRange, *nextRange)))
+
+    def getInvoicePages(invoiceID):
+        """ yield (items, failedOffsets) for each range of invoiceID in offset order as they are retrieved """
+        while len(pages) > 0 and pages[0][0] == invoiceID:
+            page = pages.popleft()[1].result()
+            submitNextRange()
+            yield page
+
+    for i in range(rangesPerWorker * workers):
+        submitNextRange()
+
+    failedPages = []
+    serviceInvoiceDate = None
+    serviceMonths = None
+    for invoice in invoiceList:
+        if (float(invoice['invoiceTotalAmount']) == 0) and (float(invoice['invoiceTotalRecurringAmount']) == 0):
+            continue
+
+        invoiceID = invoice['id']
+        invoiceDate, mask = invoiceDates[invoiceID]
+        portalInvoiceDate = invoiceDate.strftime("%Y-%m-%d")
+        portalInvoiceTime = invoiceDate.strftime("%H:%M:%S%z")
         invoiceTotalAmount = float(invoice['invoiceTotalAmount'])
         CFTSInvoiceDate = getCFTSInvoiceDate(invoiceDate)
 
@@ -426,43 +755,38 @@ def getInvoiceDetail(startdate, enddate):
         invoiceType = invoice['typeCode']
         recurringDesc = ""
         if invoiceType == "NEW":
-            serviceDateStart = invoiceDate
-            # get last day of month
-            serviceDateEnd= serviceDateStart.replace(day=calendar.monthrange(serviceDateStart.year,serviceDateStart.month)[1])
+            # service period from invoice date to last day of month
+            serviceInvoiceDate, serviceMonths = portalInvoiceDate, 0
 
         if invoiceType == "CREDIT" or invoiceType == "ONE-TIME-CHARGE":
-            serviceDateStart = invoiceDate
-            serviceDateEnd = invoiceDate
+            serviceInvoiceDate, serviceMonths = portalInvoiceDate, -1
 
         totalItems = invoice['invoiceTopLevelItemCount']
 
         # PRINT INVOICE SUMMARY LINE
         logging.info('Invoice: {} Date: {} Type:{} Items: {} Amount: ${:,.2f}'.format(invoiceID, datetime.strftime(invoiceDate, "%Y-%m-%d"), invoiceType, totalItems, invoiceTotalRecurringAmount))
 
-        limit = 75 ## set limit of record returned
-        for offset in range(0, totalItems, limit):
-            if ( totalItems - offset - limit ) < 0:
-                remaining = totalItems - offset
-            logging.info("Retrieving %s invoice line items for Invoice %s at Offset %s of %s" % (limit, invoiceID, offset, totalItems))
-
-            if datetime.strptime(invoice['createDate'], "%Y-%m-%dT%H:%M:%S%z").astimezone(dallas) < datetime(year=2023,month=5,day=1,hour=0,minute=0).astimezone(dallas):
-                    """ if invoice date before May 2023, don't query dPart for toplevel and children """
-                    mask = "id,billingItemId,categoryCode,category,category.group,hourlyFlag,hostName,domainName,location,notes,product.description,product.taxCategory,product.attributes.attributeType," \
-                                "createDate,totalRecurringAmount,totalOneTimeAmount,usageChargeFlag,hourlyRecurringFee,children.billingItemId,children.description,children.category.group," \
-                                "children.categoryCode,children.product,children.product.taxCategory,children.product.attributes,children.product.attributes.attributeType,children.recurringFee"
-            else:
-                    """ if invoice date after April 2023 query dPart for toplevel and children """
-                    mask = "id,billingItemId,categoryCode,category,category.group,hourlyFlag,hostName,domainName,location,notes,product.description,product.taxCategory,product.attributes.attributeType," \
-                                "createDate,totalRecurringAmount,totalOneTimeAmount,usageChargeFlag,hourlyRecurringFee,children.billingItemId,children.description,children.category.group," \
-                                "children.categoryCode,children.product,children.product.taxCategory,children.product.attributes,children.product.attributes.attributeType,children.recurringFee"
-
-            try:
-                Billing_Invoice = client['Billing_Invoice'].getInvoiceTopLevelItems(id=invoiceID, limit=limit,offset=offset,mask=mask)
-            except SoftLayer.SoftLayerAPIError as e:
-                logging.error("Billing_Invoice::getInvoiceTopLevelItems: %s, %s" % (e.faultCode, e.faultString))
-                quit(1)
-
-            count = 0
+        invoiceItems = []
+        invoiceComplete = True
+        cachedItems = None
+        if invoiceID in cachedInvoices:
+            """ cached items are only read when the invoice is parsed so one invoice is held in memory at a time """
+            cachedItems = readInvoiceCache(invoice)
+        if cachedItems != None:
+            invoicePages = [(cachedItems, [])]
+        elif invoiceID in cachedInvoices:
+            """ unreadable cache file, retrieve the invoice now """
+            cachedInvoices.discard(invoiceID)
+            invoicePages = [getInvoiceItemRange(invoiceID, 0, totalItems, totalItems, mask)]
+        else:
+            invoicePages = getInvoicePages(invoiceID)
+        for Billing_Invoice, failedOffsets in invoicePages:
+            if cachedItems == None:
+                if len(failedOffsets) > 0:
+                    failedPages.extend([(invoiceID, failedOffset) for failedOffset in failedOffsets])
+                    invoiceComplete = False
+                if cacheDir != None:
+                    invoiceItems.extend(Billing_Invoice)
 
             # ITERATE THROUGH DETAIL
             for item in Billing_Invoice:
@@ -477,8 +801,9 @@ def getInvoiceDetail(startdate, enddate):
                 categoryName = item["category"]["name"]
                 taxCategory = item['product']['taxCategory']['name']
                 description = item['product']['description']
-                memory = getDescription("ram", item["children"])
-                os = getDescription("os", item["children"])
+                childrenIndex = getChildrenIndex(item["children"])
+                memory = getDescription("ram", childrenIndex)
+                os = getDescription("os", childrenIndex)
 
                 if 'notes' in item:
                     billing_notes = item["notes"]
@@ -507,23 +832,12 @@ def getInvoiceDetail(startdate, enddate):
                 NewEstimatedMonthly = 0
 
                 """ Get d-code for Parent Item """
-                INV_PRODID = ""
-                INV_DIV = ""
-                PLAN_ID = ""
-                if "attributes" in item["product"]:
-                    for attr in item["product"]["attributes"]:
-                        if attr["attributeType"]["keyName"] == "BLUEMIX_PART_NUMBER":
-                            INV_PRODID = attr["value"]
-                        if attr["attributeType"]["keyName"] == "BLUEMIX_SERVICE_PLAN_DIVISION":
-                            INV_DIV = attr["value"]
-                        if attr["attributeType"]["keyName"] == "BLUEMIX_SERVICE_PLAN_ID":
-                            PLAN_ID = attr["value"]
+                attributes = getProductAttributes(item["product"], parentAttributeColumns)
 
                 # If Hourly calculate hourly rate and total hours
                 if item["hourlyFlag"]:
                     # if hourly charges are previous month usage
-                    serviceDateStart = invoiceDate - relativedelta(months=1)
-                    serviceDateEnd = serviceDateStart.replace(day=calendar.monthrange(serviceDateStart.year, serviceDateStart.month)[1])
+                    serviceInvoiceDate, serviceMonths = portalInvoiceDate, 1
                     recurringDesc = "IaaS Usage"
                     hourlyRecurringFee = 0
                     hours = 0
@@ -537,48 +851,39 @@ def getInvoiceDetail(startdate, enddate):
                 else:
                     if taxCategory == "PaaS":
                         # Non Hourly PaaS Usage from actual usage two months prior
-                        serviceDateStart = invoiceDate - relativedelta(months=2)
-                        serviceDateEnd = serviceDateStart.replace(day=calendar.monthrange(serviceDateStart.year, serviceDateStart.month)[1])
+                        serviceInvoiceDate, serviceMonths = portalInvoiceDate, 2
                         recurringDesc = "Platform Service Usage"
                     elif taxCategory == "IaaS":
                         if invoiceType == "RECURRING":
                             """ fix classic archive to be usage based"""
                             if categoryName == "Archive Storage Repository":
-                                serviceDateStart = invoiceDate - relativedelta(months=1)
-                                serviceDateEnd = serviceDateStart.replace(day=calendar.monthrange(serviceDateStart.year, serviceDateStart.month)[1])
+                                serviceInvoiceDate, serviceMonths = portalInvoiceDate, 1
                                 recurringDesc = "IaaS Usage"
                             else:
-                                serviceDateStart = invoiceDate
-                                serviceDateEnd = serviceDateStart.replace(day=calendar.monthrange(serviceDateStart.year, serviceDateStart.month)[1])
+                                serviceInvoiceDate, serviceMonths = portalInvoiceDate, 0
                                 recurringDesc = "IaaS Monthly"
                     elif taxCategory == "HELP DESK":
-                        serviceDateStart = invoiceDate
-                        serviceDateEnd = serviceDateStart.replace(
-                            day=calendar.monthrange(serviceDateStart.year, serviceDateStart.month)[1])
+                        serviceInvoiceDate, serviceMonths = portalInvoiceDate, 0
                         recurringDesc = "Support Charges"
                     hourlyRecurringFee = 0
                     hours = 0
 
                 # if storage flag specified, lookup existing note from object stored in dataframe
                 if storageFlag and (category == "storage_service_enterprise" or category == "performance_storage_iops" or category == "storage_as_a_service"):
-                    result = networkStorageDF.query('billingItemId == @billingItemId')
-                    if len(result) > 0:
-                        storage_notes = result['notes'].values[0]
-                    else:
-                        storage_notes = ""
+                    storage_notes = networkStorageNotes.get(billingItemId, "")
                 else:
                     storage_notes = ""
                 if category == "storage_service_enterprise":
-                    iops = getDescription("storage_tier_level", item["children"])
-                    storage = getDescription("performance_storage_space", item["children"])
-                    snapshot = getDescription("storage_snapshot_space", item["children"])
+                    iops = getDescription("storage_tier_level", childrenIndex)
+                    storage = getDescription("performance_storage_space", childrenIndex)
+                    snapshot = getDescription("storage_snapshot_space", childrenIndex)
                     if snapshot == "":
                         description = storage + " " + iops + " "
                     else:
                         description = storage+" " + iops + " with " + snapshot
                 elif category == "performance_storage_iops":
-                    iops = getDescription("performance_storage_iops", item["children"])
-                    storage = getDescription("performance_storage_space", item["children"])
+                    iops = getDescription("performance_storage_iops", childrenIndex)
+                    storage = getDescription("performance_storage_space", childrenIndex)
                     description = storage + " " + iops
                 elif category == "storage_as_a_service":
                     if item["hourlyFlag"]:
@@ -592,19 +897,19 @@ def getInvoiceDetail(startdate, enddate):
                             hours = 0
                     else:
                         model = "Monthly"
-                    space = getStorageServiceUsage('performance_storage_space', item["children"])
-                    tier = getDescription("storage_tier_level", item["children"])
-                    snapshot = getDescription("storage_snapshot_space", item["children"])
+                    space = getStorageServiceUsage('performance_storage_space', childrenIndex)
+                    tier = getDescription("storage_tier_level", childrenIndex)
+                    snapshot = getDescription("storage_snapshot_space", childrenIndex)
                     if space == "" or tier == "":
                         description = model + " File Storage"
                     else:
                         if snapshot == "":
                             description = model + " File Storage " + space + " at " + tier
                         else:
-                            snapshotspace = getStorageServiceUsage('storage_snapshot_space', item["children"])
+                            snapshotspace = getStorageServiceUsage('storage_snapshot_space', childrenIndex)
                             description = model + " File Storage " + space + " at " + tier + " with " + snapshotspace
                 elif category == "guest_storage":
-                        imagestorage = getStorageServiceUsage("guest_storage_usage", item["children"])
+                        imagestorage = getStorageServiceUsage("guest_storage_usage", childrenIndex)
                         if imagestorage == "":
                             description = description.replace('\n', " ")
                         else:
@@ -623,10 +928,10 @@ def getInvoiceDetail(startdate, enddate):
                 recordType = "Parent"
 
                 # Append record to dataframe
-                row = {'Portal_Invoice_Date': invoiceDate.strftime("%Y-%m-%d"),
-                       'Portal_Invoice_Time': invoiceDate.strftime("%H:%M:%S%z"),
-                       'Service_Date_Start': serviceDateStart.strftime("%Y-%m-%d"),
-                       'Service_Date_End': serviceDateEnd.strftime("%Y-%m-%d"),
+                row = {'Portal_Invoice_Date': portalInvoiceDate,
+                       'Portal_Invoice_Time': portalInvoiceTime,
+                       'serviceInvoiceDate': serviceInvoiceDate,
+                       'serviceMonths': serviceMonths,
                        'IBM_Invoice_Month': CFTSInvoiceDate,
                        'Portal_Invoice_Number': invoiceID,
                        'RecordType': recordType,
@@ -653,70 +958,264 @@ def getInvoiceDetail(startdate, enddate):
                        'Type': invoiceType,
                        'Recurring_Description': recurringDesc,
                        'childTotalRecurringCharge': 0,
-                       'INV_PRODID': INV_PRODID,
-                       'INV_DIV': INV_DIV,
-                       'PLAN_ID': PLAN_ID,
                         }
+                row.update(attributes)
                 if storageFlag:
                     row["storage_notes"] = storage_notes
 
 
                 # write parent record
-                data.append(row.copy())
+                addRow(row)
                 logging.info("parent {} {} RecurringFee: {}".format(row["BillingItemId"], row["Description"],row["totalRecurringCharge"]))
                 logging.debug(row)
 
                 if len(item["children"]) > 0:
                     parseChildren(row, categoryName, description, item["children"])
 
-    columns = ['Portal_Invoice_Date',
-               'Portal_Invoice_Time',
-               'Service_Date_Start',
-               'Service_Date_End',
-               'IBM_Invoice_Month',
-               'Portal_Invoice_Number',
-               'Type',
-               'RecordType',
-               'BillingItemId',
-               'hostName',
-               'location',
-               'Category_Group',
-               'Category',
-               'TaxCategory',
-               'dPart',
-               'Description',
-               'Memory',
-               'OS',
-               'billing_notes',
-               'Hourly',
-               'Usage',
-               'Hours',
-               'HourlyRate',
-               'totalRecurringCharge',
-               'NewEstimatedMonthly',
-               'totalOneTimeAmount',
-               'InvoiceTotal',
-               'InvoiceRecurring',
-               'Recurring_Description',
-               'childBillingItemId',
-               'childParentCategory',
-               'childParentProduct',
-               'childUsage',
-               'childTotalRecurringCharge',
-               'INV_PRODID',
-               'INV_DIV',
-               'PLAN_ID',
-               'FEATURE_ID',
-               'IS_PRIVATE_NETWORK_ONLY',
-               'DUAL_PATH_NETWORK',
-               'INELIGIBLE_FOR_ACCOUNT_DISCOUNT']
-    if storageFlag:
-        columns.append("storage_notes")
+        if invoiceID in invoicePageSizes:
+            logging.info("Invoice {} retrieved in {} pages of sizes {}.".format(invoiceID, len(invoicePageSizes[invoiceID]),
+                                                                             ", ".join(map(str, invoicePageSizes.pop(invoiceID)))))
+        if cacheDir != None and invoiceID not in cachedInvoices and invoiceComplete:
+            writeInvoiceCache(invoice, mask, invoiceItems)
+        del invoiceItems, cachedItems, invoicePages
 
-    df = pd.DataFrame(data, columns=columns)
+    executor.shutdown()
+    if len(failedPages) > 0:
+        logging.warning("{} invoice pages could not be retrieved and are missing from the output: {}".format(len(failedPages),
+                        ", ".join(["Invoice {} Offset {}".format(invoiceID, offset) for invoiceID, offset in failedPages])))
+
+
+    data["Service_Date_Start"], data["Service_Date_End"] = getServiceDates(data.pop("serviceInvoiceDate"), data.pop("serviceMonths"))
+    df = setClassicUsageSchema(pd.DataFrame(data, columns=columns))
 
     return df
 
+def getReportColumns():
+    """
+    Return the classicUsage columns used by the tabs selected so only those columns are loaded from the usage store.
+    Returns None if all columns are required.
+    """
+    if detailFlag:
+        return None
+
+    columns = {"IBM_Invoice_Month", "RecordType", "Type", "totalOneTimeAmount", "totalRecurringCharge", "childTotalRecurringCharge"}
+    if reconciliationFlag:
+        columns.update(["Portal_Invoice_Number", "Portal_Invoice_Date", "Service_Date_Start", "Service_Date_End", "dPart", "Category_Group",
+                        "Category", "TaxCategory", "Description", "childParentProduct", "INV_PRODID", "INV_DIV"])
+    if summaryFlag:
+        columns.update(["dPart", "Category_Group", "Category", "Description"])
+    if serverDetailFlag:
+        columns.update(["location", "Category", "Description", "OS", "Hourly", "Hours"])
+    if cosdetailFlag:
+        columns.update(["Category_Group", "Category", "Description", "childParentProduct", "childUsage"])
+    if storageFlag:
+        columns.update(["location", "Category", "Description", "billing_notes", "storage_notes"])
+    return columns
+
+def getUsageCube(classicUsage):
+    """
+    Aggregate classicUsage once at the finest grain used by the summary and server detail tabs, each of those tabs
+    is a roll up of this cube instead of a pivot of the full dataframe.  Only keys loaded from the usage store are used.
+    """
+    keys = [key for key in ["RecordType", "Type", "dPart", "Category_Group", "Category", "Description", "OS", "location", "Hourly",
+                            "IBM_Invoice_Month"] if key in classicUsage.columns]
+    aggregates = {"Count": ("totalAmount", "size"), "totalAmount": ("totalAmount", "sum"),
+                  "totalRecurringCharge": ("totalRecurringCharge", "sum")}
+    if "Hours" in classicUsage.columns:
+        aggregates["Hours"] = ("Hours", "sum")
+    return classicUsage.groupby(keys, observed=True, dropna=False).agg(**aggregates).reset_index()
+
+# Pivot functions used by createReport only use their arguments so they can be computed in a process pool
+def getCategoryGroupSummary(usageCube):
+    """
+    Map Portal Invoices to SLIC Invoices / Create Top Sheet per SLIC month
+    """
+    parentRecords= usageCube.query('RecordType == ["Parent"]')
+    invoiceSummary = pd.pivot_table(parentRecords, index=["Type","dPart", "Category_Group", "Category"],
+                                    values=["totalAmount"],
+                                    columns=['IBM_Invoice_Month'],
+                                    aggfunc={'totalAmount': "sum",}, margins=True, margins_name="Total", fill_value=0, observed=True).\
+                                    rename(columns={'totalRecurringCharge': 'TotalRecurring'})
+    return invoiceSummary
+
+def getCategoryDetail(usageCube):
+    """
+    Build a pivot table by Category with totalRecurringCharges
+    """
+    parentRecords = usageCube.query('RecordType == ["Parent"]')
+    categorySummary = pd.pivot_table(parentRecords, index=["Type", "Category_Group", "Category", "Description"],
+                                     values=["totalAmount"],
+                                     columns=['IBM_Invoice_Month'],
+                                     aggfunc={'totalAmount': "sum"}, margins=True, margins_name="Total", fill_value=0, observed=True)
+    return categorySummary
+
+def getClassicCOS(iaascosRecords):
+    """
+    Build a pivot table of Classic Object Storage that displays charges appearing on CFTS invoice
+    """
+    iaascosSummary = pd.pivot_table(iaascosRecords, index=["Type", "Category_Group", "childParentProduct", "Category", "Description"],
+                                     values=["childUsage", "childTotalRecurringCharge"],
+                                     columns=['IBM_Invoice_Month'],
+                                     aggfunc={'childUsage': "sum", 'childTotalRecurringCharge': "sum"}, margins=True, margins_name="Total", observed=True).rename(columns={'childUsage': 'usageQty', "childTotalRecurringCharge": "totalUsageCharge"})
+    new_order = ["usageQty", "totalUsageCharge"]
+    iaascosSummary = iaascosSummary.reindex(new_order, axis=1, level=0)
+    return iaascosSummary, len(iaascosRecords.IBM_Invoice_Month.unique())
+
+def getTopSheetRecords(classicUsage, dpartDescriptions):
+    """
+    Select the records for each section of the CFTS Invoice Top Sheet once for all months and split them by IBM_Invoice_Month
+    in a single pass.  Returns list of (month, (childRecords, iaasRecords, paasRecords, creditItems)).
+    """
+
+    """ 
+    Calculate lineItemCategory for all months at once with meaningful service names so that rows summarize correctly consistent with CFTS
+    BSS child records use the d-code description, Classic IaaS parent records use Category with VMware Licensing and Network adjusted
+    """
+    partNumber = classicUsage["INV_PRODID"].str.strip()
+    hasDpartDescription = partNumber.isin(dpartDescriptions.keys())
+    dpartDescription = partNumber.map(dpartDescriptions)
+    childLineItemCategory = dpartDescription.where(hasDpartDescription, classicUsage["Description"])
+    paasLineItemCategory = dpartDescription.where(hasDpartDescription, classicUsage["childParentProduct"])
+    softwareLicense = classicUsage["Category"] == "Software License"
+    iaasLineItemCategory = pd.Series(np.select([classicUsage["Category_Group"] == "Virtual Servers and Attached Services",
+                                                softwareLicense & classicUsage["Description"].str.contains("vSAN", regex=False),
+                                                softwareLicense & classicUsage["Description"].str.contains("NSX", regex=False),
+                                                softwareLicense,
+                                                (classicUsage["Category_Group"] == "Other") & classicUsage["Category"].isin(["Network Vlan", "Network Message Delivery"])],
+                                               ["Virtual Servers and Attached Services",
+                                                "Software License VMware vSAN",
+                                                "Software License VMware NSX",
+                                                "Software License",
+                                                "Network Other"],
+                                               default=classicUsage["Category"]), index=classicUsage.index)
+
+    def partitionByMonth(records, lineItemCategory):
+        records = records.assign(lineItemCategory=lineItemCategory)
+        return records.iloc[0:0], {month: monthRecords for month, monthRecords in records.groupby("IBM_Invoice_Month", sort=False, observed=True)}
+
+    """
+    Get all the BSS child records with d-code in one of the IaaS divisions
+    Exception D026XZX DNS appears on IaaS Invoice even though not in IaaS division
+    """
+    iaasDivs = ["7D", "SQ", "5M", "U3", "U6","U7"]
+    iaasDiv = classicUsage["INV_DIV"].isin(iaasDivs)
+    dnsPart = classicUsage["INV_PRODID"] == "D026XZX"
+    childRecordType = classicUsage["RecordType"] == "Child"
+    childMask = childRecordType & (iaasDiv | dnsPart) & (classicUsage["totalAmount"] > 0)
+    noChildRecords, childRecordsByMonth = partitionByMonth(classicUsage[childMask], childLineItemCategory[childMask])
+
+    """ Get the parent Classic IaaS records not metered in BSS """
+    iaasMask = (classicUsage["RecordType"] == "Parent") & (classicUsage["TaxCategory"] != "PaaS") & (classicUsage["totalAmount"] > 0)
+    noIaasRecords, iaasRecordsByMonth = partitionByMonth(classicUsage[iaasMask], iaasLineItemCategory[iaasMask])
+
+    """
+    Include all divisions that are not considered IaaS.  Exceptions: D026XZX DNS appears on IaaS invoice even though not in IaaS division
+    """
+    paasMask = childRecordType & (classicUsage["TaxCategory"] == "PaaS") & ~iaasDiv & ~dnsPart
+    noPaasRecords, paasRecordsByMonth = partitionByMonth(classicUsage[paasMask], paasLineItemCategory[paasMask])
+
+    creditMask = classicUsage["Type"] == "CREDIT"
+    noCreditItems, creditItemsByMonth = partitionByMonth(classicUsage[creditMask], classicUsage["Category"][creditMask])
+
+    return [(month, (childRecordsByMonth.get(month, noChildRecords), iaasRecordsByMonth.get(month, noIaasRecords),
+                     paasRecordsByMonth.get(month, noPaasRecords), creditItemsByMonth.get(month, noCreditItems)))
+            for month in classicUsage.IBM_Invoice_Month.unique()]
+
+def getTopSheetPivots(childRecords, iaasRecords, paasRecords, creditItems):
+    """
+    Build the IaaS, PaaS and Credit pivot tables for one month of the CFTS Invoice Top Sheet, PaaS and Credit are None if there are no records.
+    """
+    combined = pd.concat([childRecords, iaasRecords])
+
+    iaasInvoice = pd.pivot_table(combined, index=["Portal_Invoice_Number", "Type", "Portal_Invoice_Date", "Service_Date_Start", "Service_Date_End", "dPart", "lineItemCategory"],
+                                  values=["totalAmount"],
+                                  aggfunc=sum, margins=True,
+                                  margins_name="Total", fill_value=0, observed=True)
+    paasSummary = None
+    if len(paasRecords) > 0:
+        paasSummary = pd.pivot_table(paasRecords, index=["Portal_Invoice_Number", "Type", "Portal_Invoice_Date","Service_Date_Start", "Service_Date_End","dPart", "lineItemCategory"],
+                                        values=["totalAmount"],
+                                        aggfunc=sum, margins=True,
+                                        fill_value=0, observed=True)
+    creditSummary = None
+    if len(creditItems) > 0:
+        creditSummary = pd.pivot_table(creditItems, index=["Portal_Invoice_Number", "Type", "Portal_Invoice_Date","Service_Date_Start", "Service_Date_End","dPart", "lineItemCategory"],
+                               values=["totalAmount"],
+                               aggfunc=sum, margins=True, margins_name="Total",
+                               fill_value=0, observed=True)
+    return iaasInvoice, paasSummary, creditSummary
+
+def getStoragePivot(storage):
+    """
+    Build a pivot table for Storage as a Service by Volume Name
+    """
+    st = pd.pivot_table(storage,
+                        index=["location", "Category", "billing_notes", "storage_notes", "Description"],
+                        values=["totalRecurringCharge"],
+                        columns=['IBM_Invoice_Month'],
+                        aggfunc={'totalRecurringCharge': "sum"}, fill_value=0, observed=True).rename(
+        columns={'totalRecurringCharge': 'TotalRecurring'})
+    return st
+
+def getHourlyVirtualServers(usageCube):
+    """
+    Build a pivot table for Hourly VSI's with totalRecurringCharges
+    """
+    virtualServers = usageCube.query('Category == ["Computing Instance"] and Hourly == [True]')
+    if len(virtualServers) == 0:
+        return None
+    virtualServerPivot = pd.pivot_table(virtualServers, index=["Description", "OS"],
+                                        values=["Count", "Hours", "totalRecurringCharge"],
+                                        columns=['IBM_Invoice_Month'],
+                                        aggfunc={'Count': "sum", 'Hours': "sum",
+                                                 'totalRecurringCharge': "sum"}, fill_value=0, observed=True). \
+        rename(columns={"Count": 'qty', 'Hours': 'Total Hours', 'totalRecurringCharge': 'TotalRecurring'})
+    return virtualServerPivot
+
+def getMonthlyVirtualServers(usageCube):
+    """
+    Build a pivot table for Monthly VSI's with totalRecurringCharges
+    """
+    monthlyVirtualServers = usageCube.query('Category == ["Computing Instance"] and Hourly == [False]')
+    if len(monthlyVirtualServers) == 0:
+        return None
+    virtualServerPivot = pd.pivot_table(monthlyVirtualServers, index=["Description", "OS"],
+                                        values=["Count", "totalRecurringCharge"],
+                                        columns=['IBM_Invoice_Month'],
+                                        aggfunc={'Count': "sum", 'totalRecurringCharge': "sum"},
+                                        fill_value=0, observed=True). \
+        rename(columns={"Count": 'qty', 'totalRecurringCharge': 'TotalRecurring'})
+    return virtualServerPivot
+
+def getHourlyBareMetalServers(usageCube):
+    """
+    Build a pivot table for Hourly Bare Metal with totalRecurringCharges
+    """
+    bareMetalServers = usageCube.query('Category == ["Server"]and Hourly == [True]')
+    if len(bareMetalServers) == 0:
+        return None
+    pivot = pd.pivot_table(bareMetalServers, index=["Description", "OS"],
+                           values=["Count", "Hours", "totalRecurringCharge"],
+                           columns=['IBM_Invoice_Month'],
+                           aggfunc={'Count': "sum", 'totalRecurringCharge': "sum"}, fill_value=0, observed=True). \
+        rename(columns={"Count": 'qty', 'Hours': "sum", 'totalRecurringCharge': 'TotalRecurring'})
+    return pivot
+
+def getMonthlyBareMetalServers(usageCube):
+    """
+    Build a pivot table for Monthly Bare Metal with totalRecurringCharges
+    """
+    monthlyBareMetalServers = usageCube.query('Category == ["Server"] and Hourly == [False]')
+    if len(monthlyBareMetalServers) == 0:
+        return None
+    pivot = pd.pivot_table(monthlyBareMetalServers, index=["location", "Description", "OS"],
+                           values=["Count", "totalRecurringCharge"],
+                           columns=['IBM_Invoice_Month'],
+                           aggfunc={'Count': "sum", 'totalRecurringCharge': "sum"}, fill_value=0, observed=True). \
+        rename(columns={"Count": 'qty', 'totalRecurringCharge': 'TotalRecurring'})
+    return pivot
+
+
 def createReport(filename, classicUsage):
 
     """
@@ -728,16 +1227,16 @@ def createReport(filename, classicUsage):
         Write detail tab to excel
         """
         logging.info("Creating detail tab.")
-        classicUsage.to_excel(writer, sheet_name='Detail')
-        usdollar = workbook.add_format({'num_format': '$#,##0.00'})
-        format2 = workbook.add_format({'align': 'left'})
-        worksheet = writer.sheets['Detail']
-        worksheet.set_column('Q:AA', 18, usdollar)
-        worksheet.set_column('AB:AB', 18, format2)
-        worksheet.set_column('AC:AC', 18, usdollar)
-        worksheet.set_column('W:W', 18, format2 )
-        totalrows,totalcols=classicUsage.shape
-        worksheet.autofilter(0,0,totalrows,totalcols)
+        usdollar = reportWriter.getFormat(workbook, "currency")
+        format2 = reportWriter.getFormat(workbook, "left")
+        for sheetName, totalrows in reportWriter.writeDetail(writer, classicUsage, 'Detail'):
+            worksheet = writer.sheets[sheetName]
+            worksheet.set_column('Q:AA', 18, usdollar)
+            worksheet.set_column('AB:AB', 18, format2)
+            worksheet.set_column('AC:AC', 18, usdollar)
+            worksheet.set_column('W:W', 18, format2 )
+            totalcols = classicUsage.shape[1]
+            worksheet.autofilter(0,0,totalrows,totalcols)
         return
 
     def createAccountDetailTab(accountDetail):
@@ -746,7 +1245,7 @@ def createReport(filename, classicUsage):
         """
         logging.info("Creating account tab.")
         accountDetail.to_excel(writer, sheet_name='AccountDetail')
-        format2 = workbook.add_format({'align': 'left'})
+        format2 = reportWriter.getFormat(workbook, "left")
         worksheet = writer.sheets['AccountDetail']
         worksheet.set_column('A:A', 5, format2)
         worksheet.set_column('B:B', 8, format2)
@@ -768,344 +1267,189 @@ def createReport(filename, classicUsage):
         """
         logging.info("Creating user tab.")
         userList.to_excel(writer, sheet_name='Users')
-        format2 = workbook.add_format({'align': 'left'})
+        format2 = reportWriter.getFormat(workbook, "left")
         worksheet = writer.sheets['Users']
         worksheet.set_column('A:S', 20, format2)
         totalrows,totalcols=userList.shape
         worksheet.autofilter(0,0,totalrows,totalcols)
         return
-    def createCategoryGroupSummary(classicUsage):
-        """
-        Map Portal Invoices to SLIC Invoices / Create Top Sheet per SLIC month
-        """
-    
-        if len(classicUsage)>0:
-            logging.info("Creating CategoryGroupSummary Tab.")
-            parentRecords= classicUsage.query('RecordType == ["Parent"]')
-            invoiceSummary = pd.pivot_table(parentRecords, index=["Type","dPart", "Category_Group", "Category"],
-                                            values=["totalAmount"],
-                                            columns=['IBM_Invoice_Month'],
-                                            aggfunc={'totalAmount': "sum",}, margins=True, margins_name="Total", fill_value=0).\
-                                            rename(columns={'totalRecurringCharge': 'TotalRecurring'})
-            invoiceSummary.to_excel(writer, sheet_name='CategoryGroupSummary')
-            worksheet = writer.sheets['CategoryGroupSummary']
-            format1 = workbook.add_format({'num_format': '$#,##0.00'})
-            format2 = workbook.add_format({'align': 'left'})
-            worksheet.set_column("A:A", 20, format2)
-            worksheet.set_column("B:B", 20, format2)
-            worksheet.set_column("C:C", 40, format2)
-            worksheet.set_column("D:D", 60, format2)
-            worksheet.set_column("E:ZZ", 18, format1)
-        return
-    def createCategooryDetail(classicUsage):
-        """
-        Build a pivot table by Category with totalRecurringCharges
-        tab name CategorySummary
-        """
-    
-        if len(classicUsage) > 0:
-            logging.info("Creating CategoryDetail Tab.")
-            parentRecords = classicUsage.query('RecordType == ["Parent"]')
-            categorySummary = pd.pivot_table(parentRecords, index=["Type", "Category_Group", "Category", "Description"],
-                                             values=["totalAmount"],
-                                             columns=['IBM_Invoice_Month'],
-                                             aggfunc={'totalAmount': "sum"}, margins=True, margins_name="Total", fill_value=0)
-            categorySummary.to_excel(writer, sheet_name='CategoryDetail')
-            worksheet = writer.sheets['CategoryDetail']
-            format1 = workbook.add_format({'num_format': '$#,##0.00'})
-            format2 = workbook.add_format({'align': 'left'})
-            worksheet.set_column("A:A", 20, format2)
-            worksheet.set_column("B:C", 50, format2)
-            worksheet.set_column("D:D", 60, format2)
-            worksheet.set_column("E:ZZ", 18, format1)
-        return
-    def createClassicCOS(classicUsage):
-        """
-        Build a pivot table of Classic Object Storage that displays charges appearing on CFTS invoice
-        """
-        if len(classicUsage) > 0:
-            iaascosRecords = classicUsage.query('RecordType == ["Child"] and childParentProduct == ["Cloud Object Storage - S3 API"]')
-            if len(iaascosRecords) > 0:
-                logging.info("Creating Classic_COS Tab.")
-                iaascosSummary = pd.pivot_table(iaascosRecords, index=["Type", "Category_Group", "childParentProduct", "Category", "Description"],
-                                                 values=["childUsage", "childTotalRecurringCharge"],
-                                                 columns=['IBM_Invoice_Month'],
-                                                 aggfunc={'childUsage': "sum", 'childTotalRecurringCharge': "sum"}, margins=True, margins_name="Total").rename(columns={'childUsage': 'usageQty', "childTotalRecurringCharge": "totalUsageCharge"})
-                new_order = ["usageQty", "totalUsageCharge"]
-                iaascosSummary = iaascosSummary.reindex(new_order, axis=1, level=0)
-                iaascosSummary.to_excel(writer, sheet_name='Classic_COS')
-                worksheet = writer.sheets['Classic_COS']
-                format1 = workbook.add_format({'num_format': '$#,##0.00'})
-                format2 = workbook.add_format({'align': 'left'})
-                format3 = workbook.add_format({'num_format': '#,##0.000'})
-                worksheet.set_column("A:A", 20, format2)
-                worksheet.set_column("B:E", 40, format2)
-                """ format variable month columns for usage vs cost """
-                months = len(iaascosRecords.IBM_Invoice_Month.unique())
-                worksheet.set_column(5, 4 + months + 1, 18, format3)
-                worksheet.set_column(4 + months + 2,  4 + months + 2 + months + 1, 18, format1)
-        return
-    def createTopSheet(classicUsage):
+    def createCategoryGroupSummary(invoiceSummary):
         """
-        Build a pivot table of items that typically show on CFTS invoice at child level
-        paasCodes that appear on IaaS Invoice
+        Write CategoryGroupSummary tab to excel
         """
-
-        months = classicUsage.IBM_Invoice_Month.unique()
-        for i in months:
-            logging.info("Creating CFTS Invoice Top Sheet tab for {}.".format(i))
-            if len(classicUsage) > 0:
-                """
-                Get all the BSS child records with d-code in one of the IaaS divisions
-                Exception D026XZX DNS appears on IaaS Invoice even though not in IaaS division
-                """
-                logging.info("Creating Infrastructure-as-a-Service detail for {}.".format(i))
-                iaasDivs = ["7D", "SQ", "5M", "U3", "U6","U7"]
-                childRecords = classicUsage.query('RecordType == ["Child"] and (INV_DIV in @iaasDivs or INV_PRODID == "D026XZX") and totalAmount > 0 and IBM_Invoice_Month == @i').copy()
-
-                """ 
-                Populate lineItemCateoogry with meaningful service name so that rows summarize correctly consistent with CFTS
-                """
-                childRecords["lineItemCategory"] = childRecords["Description"]
-                for index, row in childRecords.iterrows():
-                    part_number = row["INV_PRODID"].strip()
-                    if part_number in dpartDescriptions:
-                        childRecords.at[index, "lineItemCategory"] = dpartDescriptions[part_number]
-
-                """ Get the parent Classic IaaS records not metered in BSS """
-                iaasRecords = classicUsage.query('(IBM_Invoice_Month == @i and RecordType == ["Parent"] and TaxCategory != ["PaaS"] and totalAmount > 0)').copy()
-
-                """
-                Create a new lineItemCategory column for table based on Category
-                Adjust VMware Licensing so the description is meaingful
-                """
-                iaasRecords["lineItemCategory"] = iaasRecords["Category"]
-                for index, row in iaasRecords.iterrows():
-                    if row["Category_Group"] == "Virtual Servers and Attached Services":
-                        iaasRecords.at[index, "lineItemCategory"] = "Virtual Servers and Attached Services"
-                    elif row["Category"] == "Software License":
-                        if "vSAN" in row["Description"]:
-                            iaasRecords.at[index, "lineItemCategory"] = "Software License VMware vSAN"
-                        elif "NSX" in row["Description"]:
-                            iaasRecords.at[index, "lineItemCategory"] = "Software License VMware NSX"
-                        else:
-                            iaasRecords.at[index, "lineItemCategory"] = "Software License"
-                    elif row["Category_Group"] == "Other" and (row["Category"] == "Network Vlan" or row["Category"] == "Network Message Delivery") :
-                        iaasRecords.at[index, "lineItemCategory"] = "Network Other"
-
-                combined = pd.concat([childRecords, iaasRecords])
-
-                iaasInvoice = pd.pivot_table(combined, index=["Portal_Invoice_Number", "Type", "Portal_Invoice_Date", "Service_Date_Start", "Service_Date_End", "dPart", "lineItemCategory"],
-                                              values=["totalAmount"],
-                                              aggfunc=sum, margins=True,
-                                              margins_name="Total", fill_value=0)
-
-                iaasInvoice.to_excel(writer, sheet_name='TopSheet_{}'.format(i),startcol=0, startrow=1)
-                worksheet = writer.sheets['TopSheet_{}'.format(i)]
-                format1 = workbook.add_format({'num_format': '$#,##0.00'})
-                format2 = workbook.add_format({'align': 'left'})
-                boldtext = workbook.add_format({'bold': True})
-                worksheet.write(0, 0, "Infrastructure as a Service Charges appearing in {}".format(i),boldtext)
-                worksheet.set_column("A:F", 20, format2)
-                worksheet.set_column("G:G", 70, format2)
-                worksheet.set_column("H:ZZ", 18, format1)
-
-                logging.info("Creating Platform as a Service Detail for {}.".format(i))
-                """
-                Include all divisions that are not considered IaaS.  Exceptions: D026XZX DNS appears on IaaS invoice even though not in IaaS division
-                """
-
-                paasRecords = classicUsage.query('RecordType == ["Child"] and TaxCategory == ["PaaS"] and INV_DIV not in @iaasDivs and INV_PRODID != "D026XZX" and IBM_Invoice_Month == @i').copy()
-
-                """ 
-                Replace lineItemCategory with meaningful service name so that rows summarize correctly consistent with CFTS
-                """
-                paasRecords["lineItemCategory"] = paasRecords["childParentProduct"]
-                for index, row in paasRecords.iterrows():
-                    part_number = row["INV_PRODID"].strip()
-                    if part_number in dpartDescriptions:
-                        paasRecords.at[index, "lineItemCategory"] = dpartDescriptions[part_number]
-
-                if len(paasRecords) > 0:
-                    startrow = len(iaasInvoice.index) + 5
-                    paasSummary = pd.pivot_table(paasRecords, index=["Portal_Invoice_Number", "Type", "Portal_Invoice_Date","Service_Date_Start", "Service_Date_End","dPart", "lineItemCategory"],
-                                                    values=["totalAmount"],
-                                                    aggfunc=sum, margins=True,
-                                                    fill_value=0)
-                    paasSummary.to_excel(writer, 'TopSheet_{}'.format(i),startcol=0, startrow=startrow)
-                    worksheet.write(startrow-1,0, "Platform as a Service Charges appearing in {}".format(i), boldtext)
-
-                creditItems = classicUsage.query('Type == "CREDIT" and IBM_Invoice_Month == @i').copy()
-
-                if len(creditItems) > 0:
-                    if len(paasRecords) > 0:
-                        startrow = startrow + len(paasSummary.index) + 4
-                    else:
-                        startrow = len(iaasInvoice.index) + 5
-
-                    logging.info("Creating Credit detail for {}.".format(i))
-
-                    creditItems["lineItemCategory"] = creditItems["Category"]
-                    pivot = pd.pivot_table(creditItems, index=["Portal_Invoice_Number", "Type", "Portal_Invoice_Date","Service_Date_Start", "Service_Date_End","dPart", "lineItemCategory"],
-                                           values=["totalAmount"],
-                                           aggfunc=sum, margins=True, margins_name="Total",
-                                           fill_value=0)
-                    pivot.to_excel(writer, sheet_name='TopSheet_{}'.format(i),startcol=0, startrow=startrow)
-                    worksheet.write(startrow - 1, 0, "Credit detail appearing in {}".format(i), boldtext)
-
+        logging.info("Creating CategoryGroupSummary Tab.")
+        invoiceSummary.to_excel(writer, sheet_name='CategoryGroupSummary')
+        worksheet = writer.sheets['CategoryGroupSummary']
+        format1 = reportWriter.getFormat(workbook, "currency")
+        format2 = reportWriter.getFormat(workbook, "left")
+        worksheet.set_column("A:A", 20, format2)
+        worksheet.set_column("B:B", 20, format2)
+        worksheet.set_column("C:C", 40, format2)
+        worksheet.set_column("D:D", 60, format2)
+        worksheet.set_column("E:ZZ", 18, format1)
         return
-    def createStorageTab(classicUsage):
+    def createCategooryDetail(categorySummary):
         """
-        Build a pivot table for Storage as a Service by Volume Name
+        Write CategoryDetail tab to excel
         """
-
-        storage = classicUsage.query(
-            'Category == ["Storage As A Service"] or Category == ["Endurance"] and Type == ["RECURRING"]')
-
-        if len(storage) > 0:
-            logging.info("Creating Storage Detail Tab.")
-            format_usdollar = workbook.add_format({'num_format': '$#,##0.00'})
-            format_leftjustify = workbook.add_format()
-            format_leftjustify.set_align('left')
-            st = pd.pivot_table(storage,
-                                index=["location", "Category", "billing_notes", "storage_notes", "Description"],
-                                values=["totalRecurringCharge"],
-                                columns=['IBM_Invoice_Month'],
-                                aggfunc={'totalRecurringCharge': "sum"}, fill_value=0).rename(
-                columns={'totalRecurringCharge': 'TotalRecurring'})
-
-            """
-            Create Storage-as-a-Service Tab
-            """
-            if st is not None:
-                st.to_excel(writer, sheet_name='StoragePivot')
-                worksheet = writer.sheets['StoragePivot']
-                worksheet.set_column("A:C", 30, format_leftjustify)
-                worksheet.set_column("D:D", 50, format_leftjustify)
-                worksheet.set_column("E:ZZ", 18, format_usdollar)
-
+        logging.info("Creating CategoryDetail Tab.")
+        categorySummary.to_excel(writer, sheet_name='CategoryDetail')
+        worksheet = writer.sheets['CategoryDetail']
+        format1 = reportWriter.getFormat(workbook, "currency")
+        format2 = reportWriter.getFormat(workbook, "left")
+        worksheet.set_column("A:A", 20, format2)
+        worksheet.set_column("B:C", 50, format2)
+        worksheet.set_column("D:D", 60, format2)
+        worksheet.set_column("E:ZZ", 18, format1)
         return
-    def createHourlyVirtualServers(classicUsage):
+    def createClassicCOS(iaascosSummary, months):
         """
-        Build a pivot table for Hourly VSI's with totalRecurringCharges
+        Write Classic_COS tab to excel
         """
-        virtualServers = classicUsage.query('Category == ["Computing Instance"] and Hourly == [True]')
-        if len(virtualServers) > 0:
-            logging.info("Creating Hourly VSI Tab.")
-            virtualServerPivot = pd.pivot_table(virtualServers, index=["Description", "OS"],
-                                                values=["Hours", "totalRecurringCharge"],
-                                                columns=['IBM_Invoice_Month'],
-                                                aggfunc={'Description': len, 'Hours': "sum",
-                                                         'totalRecurringCharge': "sum"}, fill_value=0). \
-                rename(columns={"Description": 'qty', 'Hours': 'Total Hours', 'totalRecurringCharge': 'TotalRecurring'})
-
-            virtualServerPivot.to_excel(writer, sheet_name='HrlyVirtualServers')
-            format_leftjustify = workbook.add_format()
-            format_leftjustify.set_align('left')
-            worksheet = writer.sheets['HrlyVirtualServers']
-            worksheet.set_column('A:B', 40, format_leftjustify)
-
+        logging.info("Creating Classic_COS Tab.")
+        iaascosSummary.to_excel(writer, sheet_name='Classic_COS')
+        worksheet = writer.sheets['Classic_COS']
+        format1 = reportWriter.getFormat(workbook, "currency")
+        format2 = reportWriter.getFormat(workbook, "left")
+        format3 = reportWriter.getFormat(workbook, "usage")
+        worksheet.set_column("A:A", 20, format2)
+        worksheet.set_column("B:E", 40, format2)
+        """ format variable month columns for usage vs cost """
+        worksheet.set_column(5, 4 + months + 1, 18, format3)
+        worksheet.set_column(4 + months + 2,  4 + months + 2 + months + 1, 18, format1)
         return
-    def createMonthlyVirtualServers(classicUsage):
+    def createTopSheet(i, iaasInvoice, paasSummary, creditSummary):
         """
-        Build a pivot table for Monthly VSI's with totalRecurringCharges
+        Write CFTS Invoice Top Sheet tab for month i with IaaS, PaaS and Credit sections
         """
-        monthlyVirtualServers = classicUsage.query('Category == ["Computing Instance"] and Hourly == [False]')
-        if len(monthlyVirtualServers) > 0:
-            logging.info("Creating Monthly VSI Tab.")
-            virtualServerPivot = pd.pivot_table(monthlyVirtualServers, index=["Description", "OS"],
-                                                values=["totalRecurringCharge"],
-                                                columns=['IBM_Invoice_Month'],
-                                                aggfunc={'Description': len, 'totalRecurringCharge': "sum"},
-                                                fill_value=0). \
-                rename(columns={"Description": 'qty', 'totalRecurringCharge': 'TotalRecurring'})
-            virtualServerPivot.to_excel(writer, sheet_name='MnthlyVirtualServers')
-            format_leftjustify = workbook.add_format()
-            format_leftjustify.set_align('left')
-            worksheet = writer.sheets['MnthlyVirtualServers']
-            worksheet.set_column('A:B', 40, format_leftjustify)
+        logging.info("Creating CFTS Invoice Top Sheet tab for {}.".format(i))
+        worksheet = workbook.add_worksheet('TopSheet_{}'.format(i))
+        format1 = reportWriter.getFormat(workbook, "currency")
+        format2 = reportWriter.getFormat(workbook, "left")
+        boldtext = reportWriter.getFormat(workbook, "bold")
+        worksheet.write(0, 0, "Infrastructure as a Service Charges appearing in {}".format(i),boldtext)
+        iaasInvoice.to_excel(writer, sheet_name='TopSheet_{}'.format(i),startcol=0, startrow=1)
+        worksheet.set_column("A:F", 20, format2)
+        worksheet.set_column("G:G", 70, format2)
+        worksheet.set_column("H:ZZ", 18, format1)
+
+        startrow = len(iaasInvoice.index) + 5
+        if paasSummary is not None:
+            worksheet.write(startrow-1,0, "Platform as a Service Charges appearing in {}".format(i), boldtext)
+            paasSummary.to_excel(writer, 'TopSheet_{}'.format(i),startcol=0, startrow=startrow)
+            startrow = startrow + len(paasSummary.index) + 4
+
+        if creditSummary is not None:
+            worksheet.write(startrow - 1, 0, "Credit detail appearing in {}".format(i), boldtext)
+            creditSummary.to_excel(writer, sheet_name='TopSheet_{}'.format(i),startcol=0, startrow=startrow)
         return
-    def createHourlyBareMetalServers(classicUsage):
+    def createStorageTab(st):
         """
-        Build a pivot table for Hourly Bare Metal with totalRecurringCharges
+        Create Storage-as-a-Service Tab
         """
-        bareMetalServers = classicUsage.query('Category == ["Server"]and Hourly == [True]')
-        if len(bareMetalServers) > 0:
-            logging.info("Creating Hourly Bare Metal Tab.")
-            pivot = pd.pivot_table(bareMetalServers, index=["Description", "OS"],
-                                   values=["Hours", "totalRecurringCharge"],
-                                   columns=['IBM_Invoice_Month'],
-                                   aggfunc={'Description': len, 'totalRecurringCharge': "sum"}, fill_value=0). \
-                rename(columns={"Description": 'qty', 'Hours': "sum", 'totalRecurringCharge': 'TotalRecurring'})
-            pivot.to_excel(writer, sheet_name='HrlyBaremetalServers')
-            format_leftjustify = workbook.add_format()
-            format_leftjustify.set_align('left')
-            worksheet = writer.sheets['HrlyBaremetalServers']
-            worksheet.set_column('A:B', 40, format_leftjustify)
+        logging.info("Creating Storage Detail Tab.")
+        format_usdollar = reportWriter.getFormat(workbook, "currency")
+        format_leftjustify = reportWriter.getFormat(workbook, "left")
+        st.to_excel(writer, sheet_name='StoragePivot')
+        worksheet = writer.sheets['StoragePivot']
+        worksheet.set_column("A:C", 30, format_leftjustify)
+        worksheet.set_column("D:D", 50, format_leftjustify)
+        worksheet.set_column("E:ZZ", 18, format_usdollar)
         return
-    def createMonthlyBareMetalServers(classicUsage):
+    def createServerTab(pivot, sheetName, columns):
         """
-        Build a pivot table for Monthly Bare Metal with totalRecurringCharges
+        Write server pivot to excel with left justified description columns
         """
-        monthlyBareMetalServers = classicUsage.query('Category == ["Server"] and Hourly == [False]')
-        if len(monthlyBareMetalServers) > 0:
-            logging.info("Creating Monthly Bare Metal Tab.")
-            pivot = pd.pivot_table(monthlyBareMetalServers, index=["location", "Description", "OS"],
-                                   values=["totalRecurringCharge"],
-                                   columns=['IBM_Invoice_Month'],
-                                   aggfunc={'Description': len, 'totalRecurringCharge': "sum"}, fill_value=0). \
-                rename(columns={"Description": 'qty', 'totalRecurringCharge': 'TotalRecurring'})
-            pivot.to_excel(writer, sheet_name='MthlyBaremetalServers')
-            format_leftjustify = workbook.add_format()
-            format_leftjustify.set_align('left')
-            worksheet = writer.sheets['MthlyBaremetalServers']
-            worksheet.set_column('A:C', 40, format_leftjustify)
+        pivot.to_excel(writer, sheet_name=sheetName)
+        format_leftjustify = reportWriter.getFormat(workbook, "left")
+        worksheet = writer.sheets[sheetName]
+        worksheet.set_column(columns, 40, format_leftjustify)
         return
 
     global writer, workbook
 
     # Write dataframe to excel
-    writer = pd.ExcelWriter(filename, engine='xlsxwriter')
+    writer = reportWriter.createExcelWriter(filename, args.streaming_xlsx)
     workbook = writer.book
     logging.info("Creating {}.".format(filename))
 
     # combine one time amounts and total recurring charge in datafrane
     classicUsage["totalAmount"] = classicUsage["totalOneTimeAmount"] + classicUsage["totalRecurringCharge"] + classicUsage["childTotalRecurringCharge"]
 
-    # create pivots for various tabs for Type2 SLIC based on flags
+    """
+    Compute the pivots for all requested tabs in a process pool, only the cheap record selection is done here so each
+    worker receives just the records its pivot needs.  The workbook is then written serially in the original tab order.
+    """
+    tasks = {}
+    topSheetMonths = []
+    if reconciliationFlag and len(classicUsage) > 0:
+        for month, records in getTopSheetRecords(classicUsage, dpartDescriptions):
+            topSheetMonths.append(month)
+            tasks[("TopSheet", month)] = (getTopSheetPivots, records)
+
+    if (summaryFlag or serverDetailFlag) and len(classicUsage) > 0:
+        usageCube = getUsageCube(classicUsage)
+        if summaryFlag:
+            tasks["CategoryGroupSummary"] = (getCategoryGroupSummary, (usageCube,))
+            tasks["CategoryDetail"] = (getCategoryDetail, (usageCube,))
+        if serverDetailFlag:
+            tasks["HrlyVirtualServers"] = (getHourlyVirtualServers, (usageCube,))
+            tasks["MnthlyVirtualServers"] = (getMonthlyVirtualServers, (usageCube,))
+            tasks["HrlyBaremetalServers"] = (getHourlyBareMetalServers, (usageCube,))
+            tasks["MthlyBaremetalServers"] = (getMonthlyBareMetalServers, (usageCube,))
+
+    if cosdetailFlag and len(classicUsage) > 0:
+        iaascosRecords = classicUsage.query('RecordType == ["Child"] and childParentProduct == ["Cloud Object Storage - S3 API"]')
+        if len(iaascosRecords) > 0:
+            tasks["Classic_COS"] = (getClassicCOS, (iaascosRecords,))
+
+    if storageFlag:
+        storage = classicUsage.query(
+            'Category == ["Storage As A Service"] or Category == ["Endurance"] and Type == ["RECURRING"]')
+        if len(storage) > 0:
+            tasks["StoragePivot"] = (getStoragePivot, (storage,))
+
+    pivots = reportWriter.computePivots(tasks, pivotWorkers)
+
+    # create tabs for Type2 SLIC based on flags
     if accountFlag:
         createAccountDetailTab(accountDetail)
     if userFlag:
         createUserTab(userList)
 
+    detailFiles = []
     if detailFlag:
-        createDetailTab(classicUsage)
+        if reportFormat == "xlsx":
+            createDetailTab(classicUsage)
+        else:
+            detailFiles.append(reportWriter.writeDetailFile(classicUsage, filename, "Detail", reportFormat))
 
-    if reconciliationFlag:
-        createTopSheet(classicUsage)
+    for month in topSheetMonths:
+        createTopSheet(month, *pivots[("TopSheet", month)])
 
-    if summaryFlag:
-        createCategoryGroupSummary(classicUsage)
-        createCategooryDetail(classicUsage)
+    if "CategoryGroupSummary" in pivots:
+        createCategoryGroupSummary(pivots["CategoryGroupSummary"])
+        createCategooryDetail(pivots["CategoryDetail"])
 
-    if serverDetailFlag:
-        createHourlyVirtualServers(classicUsage)
-        createMonthlyVirtualServers(classicUsage)
-        createHourlyBareMetalServers(classicUsage)
-        createMonthlyBareMetalServers(classicUsage)
+    serverTabs = [("HrlyVirtualServers", "Hourly VSI", 'A:B'), ("MnthlyVirtualServers", "Monthly VSI", 'A:B'),
+                  ("HrlyBaremetalServers", "Hourly Bare Metal", 'A:B'), ("MthlyBaremetalServers", "Monthly Bare Metal", 'A:C')]
+    for sheetName, tabName, columns in serverTabs:
+        if pivots.get(sheetName) is not None:
+            logging.info("Creating {} Tab.".format(tabName))
+            createServerTab(pivots[sheetName], sheetName, columns)
 
-    if cosdetailFlag:
-        createClassicCOS(classicUsage)
+    if "Classic_COS" in pivots:
+        createClassicCOS(*pivots["Classic_COS"])
 
-    if storageFlag:
-        createStorageTab(classicUsage)
+    if "StoragePivot" in pivots:
+        createStorageTab(pivots["StoragePivot"])
 
     # If BSS Flag set and using APIKEY then pull BSS Usage for corresponding month
     if bssFlag and args.IC_API_KEY != None:
         getBSS()
 
     writer.close()
-    return
+    return detailFiles
 
 def multi_part_upload(bucket_name, item_name, file_path):
     try:
@@ -1738,9 +2082,9 @@ def getBSS():
         vcpu = vcpu.reindex(new_order, axis=1)
         vcpu.to_excel(writer, '{}_VPC_Servers'.format(month))
         worksheet = writer.sheets['{}_VPC_Servers'.format(month)]
-        format2 = workbook.add_format({'align': 'left'})
-        format3 = workbook.add_format({'num_format': '#,##0'})
-        format4 = workbook.add_format({'num_format': '$#,##0.00'})
+        format2 = reportWriter.getFormat(workbook, "left")
+        format3 = reportWriter.getFormat(workbook, "count")
+        format4 = reportWriter.getFormat(workbook, "currency")
         worksheet.set_column("A:A", 15, format2)
         worksheet.set_column("B:B", 25, format2)
         worksheet.set_column("C:C", 15, format2)
@@ -1766,9 +2110,9 @@ def getBSS():
         volumes = volumes.reindex(new_order, axis=1)
         volumes.to_excel(writer, '{}_VPC_Volumes'.format(month))
         worksheet = writer.sheets['{}_VPC_Volumes'.format(month)]
-        format2 = workbook.add_format({'align': 'left'})
-        format3 = workbook.add_format({'num_format': '#,##0'})
-        format4 = workbook.add_format({'num_format': '$#,##0.00'})
+        format2 = reportWriter.getFormat(workbook, "left")
+        format3 = reportWriter.getFormat(workbook, "count")
+        format4 = reportWriter.getFormat(workbook, "currency")
         worksheet.set_column("A:A", 15, format2)
         worksheet.set_column("B:C", 30, format2)
         worksheet.set_column("D:D", 40, format2)
@@ -1788,8 +2132,8 @@ def getBSS():
         usageSummary = usageSummary.reindex(new_order, axis=1, level=0)
         usageSummary.to_excel(writer, 'Cloud_Usage')
         worksheet = writer.sheets['Cloud_Usage']
-        format1 = workbook.add_format({'num_format': '$#,##0.00'})
-        format2 = workbook.add_format({'align': 'left'})
+        format1 = reportWriter.getFormat(workbook, "currency")
+        format2 = reportWriter.getFormat(workbook, "left")
         worksheet.set_column("A:A", 35, format2)
         worksheet.set_column("B:ZZ", 18, format1)
 
@@ -1839,9 +2183,12 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--startdate", default=os.environ.get('startdate', None), help="Start Year & Month in format YYYY-MM")
     parser.add_argument("-e", "--enddate", default=os.environ.get('enddate', None), help="End Year & Month in format YYYY-MM")
     parser.add_argument("--debug", action=argparse.BooleanOptionalAction, help="Set Debug level for logging.")
-    parser.add_argument("--load", action=argparse.BooleanOptionalAction, help="Load dataframes from pkl files for test purposes.")
-    parser.add_argument("--save", action=argparse.BooleanOptionalAction, help="Store dataframes to pkl files for test purposes.")
+    parser.add_argument("--load", action=argparse.BooleanOptionalAction, help="Load months requested from classicUsage.parquet store instead of retrieving invoices.")
+    parser.add_argument("--save", action=argparse.BooleanOptionalAction, help="Save retrieved invoice detail to classicUsage.parquet store partitioned by IBM invoice month.")
     parser.add_argument("--months", default=os.environ.get('months', 1), help="Number of months including last full month to include in report.")
+    parser.add_argument("--workers", default=os.environ.get('workers', 4), help="Number of concurrent workers used to retrieve invoice line items.")
+    parser.add_argument("--pivot-workers", default=os.environ.get('pivot_workers', None), help="Number of processes used to compute report pivots, defaults to the number of CPUs.  1 computes them in process.")
+    parser.add_argument("--cachedir", default=os.environ.get('cachedir', None), help="Directory to cache line items of closed invoices so they are not retrieved again on later runs.")
     parser.add_argument("--COS_APIKEY", default=os.environ.get('COS_APIKEY', None), help="COS apikey to use for Object Storage.")
     parser.add_argument("--COS_ENDPOINT", default=os.environ.get('COS_ENDPOINT', None), help="COS endpoint to use for Object Storage.")
     parser.add_argument("--COS_INSTANCE_CRN", default=os.environ.get('COS_INSTANCE_CRN', None), help="COS Instance CRN to use for file upload.")
@@ -1851,6 +2198,7 @@ if __name__ == "__main__":
     parser.add_argument("--sendGridFrom", default=os.environ.get('sendGridFrom', None), help="Sendgrid from email to send output from.")
     parser.add_argument("--sendGridSubject", default=os.environ.get('sendGridSubject', None), help="SendGrid email subject for output email")
     parser.add_argument("--output", default=os.environ.get('output', 'invoice-analysis.xlsx'), help="Filename Excel output file. (including extension of .xlsx)")
+    parser.add_argument("--format", default=os.environ.get('format', 'xlsx'), choices=["xlsx", "parquet", "csv"], help="Format of detail data, parquet or csv write the Detail tab to a separate file named after the output file.")
     parser.add_argument("--SL_PRIVATE", default=False, action=argparse.BooleanOptionalAction, help="Use IBM Cloud Classic Private API Endpoint")
     parser.add_argument('--storage', default=False, action=argparse.BooleanOptionalAction, help="Include File, BLock and Classic Cloud Object Storage detail analysis.")
     parser.add_argument('--detail', default=True, action=argparse.BooleanOptionalAction, help="Whether to Write detail tabs to worksheet.")
@@ -1861,6 +2209,7 @@ if __name__ == "__main__":
     parser.add_argument('--serverdetail', default=False, action=argparse.BooleanOptionalAction, help="Whether to write server detail tabs to worksheet.")
     parser.add_argument('--classiccos', default=False, action=argparse.BooleanOptionalAction, help="Whether to write Classic Object Storage tab to worksheet.")
     parser.add_argument('--bss', default=False, action=argparse.BooleanOptionalAction, help="Retreive BSS usage for corresponding months using ibmCloudUsage.py.")
+    parser.add_argument('--streaming-xlsx', default=False, action=argparse.BooleanOptionalAction, help="Write Excel file in constant memory mode, detail rows beyond the Excel row limit continue on Detail_2, Detail_3...")
 
     args = parser.parse_args()
     if args.debug:
@@ -1881,6 +2230,10 @@ if __name__ == "__main__":
     bssFlag = args.bss
     userFlag = args.users
     accountFlag = args.accountdetail
+    workers = int(args.workers)
+    cacheDir = args.cachedir
+    reportFormat = args.format
+    pivotWorkers = int(args.pivot_workers) if args.pivot_workers != None else None
 
     if args.startdate == None or args.enddate == None:
         months = int(args.months)
@@ -1905,8 +2258,8 @@ if __name__ == "__main__":
     NOTE: internal authentication requires internal SDK version & Global Protect VPN.
     """
     if args.load == True:
-        logging.info( "Loading usage data from classicUsage.pkl file.")
-        classicUsage = pd.read_pickle("classicUsage.pkl")
+        logging.info( "Loading usage data from classicUsage.parquet store.")
+        classicUsage = setClassicUsageSchema(usageStore.loadUsage("classicUsage.parquet", "IBM_Invoice_Month", startdate, enddate, getReportColumns()))
     else:
         if args.IC_API_KEY == None:
             if args.username == None or args.password == None or args.account == None:
@@ -1952,7 +2305,7 @@ if __name__ == "__main__":
             userList = getUsers()
 
         if storageFlag:
-            networkStorageDF = getAccountNetworkStorage()
+            networkStorageDF, networkStorageNotes = getAccountNetworkStorage()
 
         # Calculate invoice dates based on SLIC invoice cutoffs.
         startdate, enddate = getInvoiceDates(startdate, enddate)
@@ -1960,10 +2313,13 @@ if __name__ == "__main__":
         #  Retrieve Invoices from classic
         classicUsage = getInvoiceDetail(startdate, enddate)
 
+        if args.save:
+            usageStore.saveUsage(classicUsage, "classicUsage.parquet", "IBM_Invoice_Month")
+
     """"
     Build Exel Report Report with Charges
     """
-    createReport(args.output, classicUsage)
+    detailFiles = createReport(args.output, classicUsage)
 
     if args.sendGridApi != None:
         sendEmail(startdate, enddate, args.sendGridTo, args.sendGridFrom, args.sendGridSubject, args.sendGridApi, args.output)
@@ -1977,5 +2333,7 @@ if __name__ == "__main__":
                                  endpoint_url=args.COS_ENDPOINT
                                  )
         multi_part_upload(args.COS_BUCKET, args.output, "./" + args.output)
+        for detailFile in detailFiles:
+            multi_part_upload(args.COS_BUCKET, detailFile, "./" + detailFile)
 
     logging.info("invoiceAnalysis complete.")
\ No newline at end of file
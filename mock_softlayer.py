@@ -18,6 +18,7 @@ Adding New Services:
 
 import random
 import logging
+from datetime import datetime, timedelta
 
 
 class MockSoftLayerAccount:
@@ -28,14 +29,17 @@ class MockSoftLayerAccount:
     such as hardware, virtual servers, network storage, etc.
     """
     
-    def __init__(self, account_id):
+    def __init__(self, account_id, invoice_months=3, invoice_items=500):
         """
         Initialize the mock Account service.
         
         @param account_id: The IMS account ID to simulate
+        @param invoice_months: Number of monthly recurring invoices to generate
+        @param invoice_items: Number of top level items on each invoice
         """
         self.account_id = account_id
         self.all_hardware = self._generate_hardware_data()
+        self.all_invoices = self._generate_invoice_data(invoice_months, invoice_items)
     
     def _generate_hardware_data(self, count=25):
         """
@@ -97,6 +101,51 @@ class MockSoftLayerAccount:
         
         return hardware_list
     
+    def _generate_invoice_data(self, months, items):
+        """
+        Generate monthly recurring invoices ending with the current month, invoices are created on the 1st at
+        01:00 Dallas time like SoftLayer recurring invoices.  Line items are generated by MockSoftLayerBillingInvoice.
+        
+        @param months: Number of invoices to generate
+        @param items: Number of top level items on each invoice
+        @return: List of invoice dictionaries
+        """
+        invoice_list = []
+        month = datetime.now().replace(day=1, hour=1, minute=0, second=0, microsecond=0)
+        for i in range(months):
+            invoice_list.insert(0, {
+                'id': 7000000 + months - i,
+                'accountId': self.account_id,
+                'createDate': month.strftime("%Y-%m-%dT%H:%M:%S-06:00"),
+                'typeCode': 'RECURRING',
+                'invoiceTotalAmount': str(round(items * 12.5, 2)),
+                'invoiceTotalRecurringAmount': str(round(items * 12.5, 2)),
+                'invoiceTopLevelItemCount': items
+            })
+            month = (month - timedelta(days=1)).replace(day=1)
+        return invoice_list
+    
+    def getInvoices(self, id=None, mask=None, filter=None):
+        """
+        Mock implementation of SoftLayer_Account.getInvoices
+        
+        Supports the createDate betweenDate filter used by invoiceAnalysis.py.
+        
+        @param id: Account ID (ignored in mock, uses self.account_id)
+        @param mask: Object mask (currently returns all data regardless)
+        @param filter: Object filter, only invoices.createDate betweenDate is applied
+        @return: List of invoice dictionaries
+        """
+        logging.info(f"Mock API: getInvoices called with id={id}")
+        result = self.all_invoices
+        if filter and 'invoices' in filter and 'createDate' in filter['invoices']:
+            options = {option['name']: datetime.strptime(option['value'][0], "%m/%d/%Y %H:%M:%S")
+                       for option in filter['invoices']['createDate']['options']}
+            result = [invoice for invoice in result
+                      if options['startDate'] <= datetime.strptime(invoice['createDate'][0:19], "%Y-%m-%dT%H:%M:%S") <= options['endDate']]
+        logging.info(f"Mock API: Returning {len(result)} invoices")
+        return result
+    
     def getHardware(self, id=None, limit=None, offset=0, mask=None):
         """
         Mock implementation of SoftLayer_Account.getHardware
@@ -121,6 +170,114 @@ class MockSoftLayerAccount:
         return result
 
 
+class MockSoftLayerBillingInvoice:
+    """
+    Mock implementation of SoftLayer_Billing_Invoice service.
+    
+    Invoice line items are generated when a page is requested, each item is seeded by invoice id and offset so
+    every request for the same page returns the same items without the mock holding whole invoices in memory.
+    """
+    
+    categories = [
+        ('guest_core', 'Computing Instance', 'Virtual Servers and Attached Services', 'IaaS'),
+        ('server', 'Server', 'Bare Metal Servers and Attached Services', 'IaaS'),
+        ('storage_service_enterprise', 'Endurance', 'Storage', 'IaaS'),
+        ('performance_storage_iops', 'Performance', 'Storage', 'IaaS'),
+        ('software_license', 'Software License', 'Other', 'IaaS'),
+        ('network_vlan', 'Network Vlan', None, 'IaaS'),
+        ('paas', 'Platform Service Plan', 'PaaS', 'PaaS'),
+    ]
+    child_descriptions = [
+        ('StorageLayer', 'Cloud Object Storage - Standard: 1234.56 GB'),
+        ('StorageLayer', 'Cloud Object Storage - API Requests: 12345 Class A'),
+        ('StorageLayer', 'Snapshot Space: 20 GB'),
+        ('Other', 'Virtual Server Instance Usage - $0.05 per 12.5 Instance-Hours Usage'),
+        ('Other', 'Flat description'),
+    ]
+    child_categories = ['ram', 'os', 'guest_core', 'guest_disk0', 'port_speed', 'bandwidth', 'pri_ip_addresses']
+    attribute_keys = ['BLUEMIX_PART_NUMBER', 'BLUEMIX_SERVICE_PLAN_DIVISION', 'BLUEMIX_SERVICE_PLAN_ID',
+                      'BLUEMIX_SERVICE_PLAN_FEATURE_ID', 'IS_PRIVATE_NETWORK_ONLY']
+    
+    def __init__(self, account):
+        """
+        Initialize the mock Billing Invoice service.
+        
+        @param account: MockSoftLayerAccount holding the invoices to generate items for
+        """
+        self.account = account
+    
+    def _generate_attributes(self, rng):
+        """
+        Generate product attributes with d-code part numbers and divisions.
+        
+        @param rng: Random generator for the item
+        @return: List of attribute dictionaries
+        """
+        return [{'attributeType': {'keyName': key}, 'value': f"{key[-4:]}{rng.randint(0, 9)}"}
+                for key in self.attribute_keys if rng.random() < 0.7]
+    
+    def _generate_item(self, invoice_id, index):
+        """
+        Generate one invoice top level item with children.
+        
+        @param invoice_id: Invoice the item belongs to
+        @param index: Offset of the item on the invoice
+        @return: Item dictionary
+        """
+        rng = random.Random(invoice_id * 1000000 + index)
+        code, name, group, tax = rng.choice(self.categories)
+        category = {'name': name}
+        if group:
+            category['group'] = {'name': group}
+        children = []
+        for c in range(rng.randint(0, 12)):
+            child_group, description = rng.choice(self.child_descriptions)
+            children.append({
+                'billingItemId': (invoice_id * 1000000 + index) * 100 + c,
+                'description': description,
+                'category': {'name': 'child', 'group': {'name': child_group}},
+                'categoryCode': rng.choice(self.child_categories),
+                'product': {'description': f"Child product {rng.randint(0, 50)}", 'taxCategory': {'name': tax},
+                            'attributes': self._generate_attributes(rng)},
+                'recurringFee': str(rng.choice([0, 0, 1.25, 10.5]))
+            })
+        return {
+            'id': index,
+            'billingItemId': 100000000 + index,
+            'categoryCode': code,
+            'category': category,
+            'hourlyFlag': rng.random() < 0.4,
+            'hostName': f"host{index:05d}",
+            'domainName': 'example.com',
+            'location': {'longName': rng.choice(['Dallas 10', 'Washington 7', 'London 2', 'Tokyo 2'])},
+            'notes': f"note {index}",
+            'product': {'description': f"{name} {rng.randint(1, 64)} GB", 'taxCategory': {'name': tax},
+                        'attributes': self._generate_attributes(rng)},
+            'createDate': '2024-01-01T00:00:00-06:00',
+            'totalRecurringAmount': str(round(rng.random() * 100, 3)),
+            'totalOneTimeAmount': str(rng.choice([0, 0, 5.5])),
+            'hourlyRecurringFee': str(rng.choice([0, 0.05, 0.2])),
+            'usageChargeFlag': rng.random() < 0.3,
+            'children': children
+        }
+    
+    def getInvoiceTopLevelItems(self, id=None, limit=None, offset=0, mask=None):
+        """
+        Mock implementation of SoftLayer_Billing_Invoice.getInvoiceTopLevelItems
+        
+        @param id: Invoice ID
+        @param limit: Number of results to return
+        @param offset: Offset for pagination
+        @param mask: Object mask (currently returns all data regardless)
+        @return: List of invoice top level item dictionaries
+        """
+        logging.info(f"Mock API: getInvoiceTopLevelItems called with id={id}, limit={limit}, offset={offset}")
+        invoice = next((invoice for invoice in self.account.all_invoices if invoice['id'] == id), None)
+        total = invoice['invoiceTopLevelItemCount'] if invoice else 0
+        end = min(total, offset + limit) if limit else total
+        return [self._generate_item(id, index) for index in range(offset, end)]
+
+
 class MockSoftLayerNetwork:
     """
     Mock implementation of SoftLayer_Network service.
@@ -169,7 +326,8 @@ class MockSoftLayerClient:
     but returns simulated data instead of making actual API calls.
     
     Available Services:
-        - Account: Account-level operations (hardware, virtual servers, etc.)
+        - Account: Account-level operations (hardware, invoices, etc.)
+        - Billing_Invoice: Invoice line items
         - Network: Network operations (placeholder for future implementation)
         - Virtual_Guest: Virtual server operations (placeholder)
     
@@ -178,19 +336,23 @@ class MockSoftLayerClient:
         hardware = client['Account'].getHardware(id='123456', limit=10)
     """
     
-    def __init__(self, account_id=None, **kwargs):
+    def __init__(self, account_id=None, invoice_months=3, invoice_items=500, **kwargs):
         """
         Initialize the mock SoftLayer client.
         
         @param account_id: The IMS account ID to simulate
+        @param invoice_months: Number of monthly recurring invoices to generate
+        @param invoice_items: Number of top level items on each invoice
         @param kwargs: Additional parameters (ignored, for compatibility with real client)
         """
         self.account_id = account_id
         
         # Register all available mock services
         # Add new services here as they are implemented
+        account = MockSoftLayerAccount(account_id, invoice_months, invoice_items)
         self.services = {
-            'Account': MockSoftLayerAccount(account_id),
+            'Account': account,
+            'Billing_Invoice': MockSoftLayerBillingInvoice(account),
             'Network': MockSoftLayerNetwork(account_id),
             'Virtual_Guest': MockSoftLayerVirtualGuest(account_id),
         }
@@ -0,0 +1,131 @@
+# Author: Jon Hall
+# Copyright (c) 2023
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Excel writer, detail file export and pivot computation used by invoiceAnalysis.py and ibmCloudUsage.py
+
+With --streaming-xlsx the workbook is created in xlsxwriter constant_memory mode, each row is flushed to disk when the
+next row is started so a detail tab no longer has to fit in memory.  In this mode a row can not be written once a later
+row has been started, so sheet titles must be written before the dataframe below them.
+
+Pivots for the tabs are computed in a process pool by computePivots, a workbook is a single file so the sheets are
+still written serially by the caller once all pivots are returned.
+
+Cell formats are created once per workbook by getFormat and shared by every tab instead of each tab adding its own
+copy of the same format.
+"""
+
+__author__ = 'jonhall'
+import os, logging, weakref
+import concurrent.futures
+import pandas as pd
+import usageStore
+
+# Excel row limit per worksheet
+maxRows = 1048576
+
+# Cell formats shared by report tabs, see getFormat
+reportFormats = {
+    "currency": {'num_format': '$#,##0.00'},
+    "left": {'align': 'left'},
+    "bold": {'bold': True},
+    "count": {'num_format': '#,##0'},
+    "usage": {'num_format': '#,##0.000'},
+    "metricUsage": {'num_format': '#,##0.00000'},
+}
+workbookFormats = weakref.WeakKeyDictionary()
+
+def getFormat(workbook, name):
+    """
+    Return the named format from reportFormats for workbook, the format is added to the workbook the first time it
+    is requested and reused by every later tab.  Shared formats must not be modified by the caller.
+    """
+    formats = workbookFormats.setdefault(workbook, {})
+    if name not in formats:
+        formats[name] = workbook.add_format(reportFormats[name])
+    return formats[name]
+
+def createExcelWriter(filename, streaming=False):
+    """
+    Create pandas ExcelWriter using xlsxwriter, if streaming use constant_memory mode.
+    """
+    if not streaming:
+        return pd.ExcelWriter(filename, engine='xlsxwriter')
+
+    logging.info("Creating {} in streaming (constant memory) mode.".format(filename))
+    writer = pd.ExcelWriter(filename, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}})
+    writeCells = writer._write_cells
+
+    def writeRowOrder(cells, sheet_name=None, startrow=0, startcol=0, freeze_panes=None):
+        """
+        pandas writes dataframe cells column by column, constant_memory only keeps the current row so write cells in
+        row order.  Merged index cells span rows so they are written as single cells.
+        """
+        cells = sorted(cells, key=lambda cell: (cell.row, cell.col))
+        for cell in cells:
+            cell.mergestart = None
+            cell.mergeend = None
+        writeCells(cells, sheet_name, startrow, startcol, freeze_panes)
+
+    writer._write_cells = writeRowOrder
+    return writer
+
+def writeDetail(writer, df, sheetName, chunkSize=10000):
+    """
+    Write detail dataframe to sheetName.  In streaming mode rows are written in chunks and rows beyond the Excel row limit
+    continue on sheetName_2, sheetName_3, ...  Returns list of (sheet name, rows) written so each sheet can be formatted.
+    """
+    if not writer.book.constant_memory:
+        df.to_excel(writer, sheet_name=sheetName)
+        return [(sheetName, len(df))]
+
+    sheets = []
+    rowsPerSheet = maxRows - 1
+    for sheetStart in range(0, max(len(df), 1), rowsPerSheet):
+        sheet = sheetName if sheetStart == 0 else "{}_{}".format(sheetName, len(sheets) + 1)
+        sheetRows = min(rowsPerSheet, len(df) - sheetStart)
+        if sheetStart > 0:
+            logging.info("Continuing {} on {}.".format(sheetName, sheet))
+        df.iloc[0:0].to_excel(writer, sheet_name=sheet)
+        for chunkStart in range(sheetStart, sheetStart + sheetRows, chunkSize):
+            chunk = df.iloc[chunkStart:min(chunkStart + chunkSize, sheetStart + sheetRows)]
+            chunk.to_excel(writer, sheet_name=sheet, header=False, startrow=chunkStart - sheetStart + 1)
+        sheets.append((sheet, sheetRows))
+    return sheets
+
+def writeDetailFile(df, output, tabName, fileFormat):
+    """
+    Write detail dataframe to a parquet or csv file named after the Excel output file and tab instead of an Excel tab,
+    ie. invoice-analysis_Detail.parquet.  Returns file name written.
+    """
+    filename = "{}_{}.{}".format(os.path.splitext(output)[0], tabName, fileFormat)
+    logging.info("Writing {} rows of {} to {}.".format(len(df), tabName, filename))
+    if fileFormat == "parquet":
+        usageStore.normalizeColumns(df).to_parquet(filename, engine="pyarrow", index=False)
+    else:
+        df.to_csv(filename, index=False)
+    return filename
+
+def computePivots(tasks, workers=None):
+    """
+    Compute report pivots in a process pool.  tasks is a dict of name: (function, args), function must be a module level
+    function that only uses its args.  Returns dict of name: result.  If workers is 1 or there is only one task they are
+    computed in process.
+    """
+    if len(tasks) <= 1 or workers == 1:
+        return {name: function(*functionArgs) for name, (function, functionArgs) in tasks.items()}
+
+    logging.info("Computing {} pivots in process pool.".format(len(tasks)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(function, *functionArgs) for name, (function, functionArgs) in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,101 @@
+# Author: Jon Hall
+# Copyright (c) 2023
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+SoftLayer API call wrapper used by invoiceAnalysis.py, classicConfigAnalysis.py, classicConfigReport.py and
+classicConfigStorage.py
+
+callAPI retries transient faults (connection errors, timeouts, rate limiting and server errors) with jittered
+exponential backoff, other faults such as authentication or invalid parameters are raised on the first attempt.
+Retries from every call in a run come out of one retry budget so an API outage still ends the run, and calls from
+all threads are paced by a token bucket so parallel retrieval stays under the API rate limit.
+"""
+
+__author__ = 'jonhall'
+import logging, random, threading, time
+import SoftLayer
+
+# retries per call and backoff in seconds, the delay before retry n is random between 0 and min(maxDelay, baseDelay * 2^n)
+maxRetries = 5
+baseDelay = 1
+maxDelay = 60
+# retries allowed across all calls of a run
+retryBudget = 100
+# token bucket, average calls per second across all threads and calls allowed in a burst
+callsPerSecond = 20
+callBurst = 20
+
+# transport status codes worth retrying, 0 is a connection error or timeout
+retryableFaultCodes = [0, 408, 429, 500, 502, 503, 504]
+retryableFaults = ["SoftLayer_Exception_WebService_RateLimitExceeded", "SoftLayer_Exception_Public_Timeout"]
+retryableFaultStrings = ["timed out", "timeout", "rate limit", "too many requests", "temporarily unavailable"]
+
+retriesUsed = 0
+tokens = callBurst
+lastRefill = time.monotonic()
+lock = threading.Lock()
+
+def isRetryable(e):
+    """
+    Classify a SoftLayerAPIError as retryable (transient) or fatal
+    """
+    if e.faultCode in retryableFaults:
+        return True
+    if isinstance(e, SoftLayer.TransportError) and e.faultCode in retryableFaultCodes:
+        return True
+    if isinstance(e, SoftLayer.InternalError):
+        return True
+    faultString = str(e.faultString).lower()
+    return any(reason in faultString for reason in retryableFaultStrings)
+
+def acquireToken():
+    """
+    Wait until the token bucket allows another call
+    """
+    global tokens, lastRefill
+    while True:
+        with lock:
+            now = time.monotonic()
+            tokens = min(callBurst, tokens + (now - lastRefill) * callsPerSecond)
+            lastRefill = now
+            if tokens >= 1:
+                tokens = tokens - 1
+                return
+            wait = (1 - tokens) / callsPerSecond
+        time.sleep(wait)
+
+def callAPI(client, service, method, *args, giveUp=None, **kwargs):
+    """
+    Call SoftLayer service method with retries, ie. callAPI(client, 'Account', 'getInvoices', id=ims_account, mask=mask)
+    Faults that are not retryable, or where giveUp(e) is True, are raised to the caller, as is the last fault once
+    maxRetries or the retry budget is used up.
+    """
+    global retriesUsed
+    attempt = 0
+    while True:
+        acquireToken()
+        try:
+            return getattr(client[service], method)(*args, **kwargs)
+        except SoftLayer.SoftLayerAPIError as e:
+            if (giveUp != None and giveUp(e)) or not isRetryable(e) or attempt >= maxRetries:
+                raise
+            with lock:
+                if retriesUsed >= retryBudget:
+                    logging.error("SoftLayer API retry budget of {} retries is exhausted.".format(retryBudget))
+                    raise
+                retriesUsed = retriesUsed + 1
+            attempt = attempt + 1
+            delay = random.uniform(0, min(maxDelay, baseDelay * 2 ** attempt))
+            logging.warning("{}::{}: {}, {}.  Retry {} of {} in {:.1f} seconds.".format(service, method, e.faultCode, e.faultString,
+                                                                                   attempt, maxRetries, delay))
+            time.sleep(delay)
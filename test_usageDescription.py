@@ -0,0 +1,104 @@
+# Author: Jon Hall
+# Copyright (c) 2023
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Unit tests for usageDescription.py, one test per description format listed in the module docstring.
+
+Run with: python -m unittest test_usageDescription  (or python -m pytest test_usageDescription.py)
+"""
+
+__author__ = 'jonhall'
+import unittest
+import usageDescription
+from usageDescription import parseStorageLayerDescription, parseUsageDescription
+
+
+class TestParseStorageLayerDescription(unittest.TestCase):
+
+    def setUp(self):
+        parseStorageLayerDescription.cache_clear()
+
+    def test_decimal_usage(self):
+        self.assertEqual(parseStorageLayerDescription("Cloud Object Storage - Standard: 1234.56 GB"),
+                         ("Cloud Object Storage - Standard", 1234.56))
+
+    def test_api_requests(self):
+        description, usage = parseStorageLayerDescription("Cloud Object Storage - API Requests: 12345 Class A")
+        self.assertEqual(description, "Cloud Object Storage - API Requests")
+        self.assertEqual(usage, 12345.0)
+        self.assertIsInstance(usage, float)
+
+    def test_snapshot_space(self):
+        self.assertEqual(parseStorageLayerDescription("Snapshot Space: 20 GB"), ("Snapshot Space", 20.0))
+
+    def test_replication_for_tier(self):
+        description, usage = parseStorageLayerDescription("Replication for tier: 2 IOPS")
+        self.assertEqual(description, "Replication for tier")
+        self.assertEqual(usage, 0)
+        self.assertIsInstance(usage, int)
+
+    def test_no_colon(self):
+        self.assertEqual(parseStorageLayerDescription("Flat description"), ("Flat description", ""))
+
+    def test_cache_reuse(self):
+        first = parseStorageLayerDescription("Snapshot Space: 20 GB")
+        second = parseStorageLayerDescription("Snapshot Space: 20 GB")
+        parseStorageLayerDescription("Replication for tier: 2 IOPS")
+        self.assertIs(first, second)
+        info = parseStorageLayerDescription.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 2))
+
+    def test_cache_bounded(self):
+        for i in range(usageDescription.descriptionCacheSize + 10):
+            parseStorageLayerDescription("Cloud Object Storage - Standard: {}.5 GB".format(i))
+        info = parseStorageLayerDescription.cache_info()
+        self.assertEqual(info.currsize, usageDescription.descriptionCacheSize)
+
+
+class TestParseUsageDescription(unittest.TestCase):
+
+    def setUp(self):
+        parseUsageDescription.cache_clear()
+
+    def test_usage(self):
+        self.assertEqual(parseUsageDescription("Some usage - $0.10 per 3.25 GB Usage"), ("Some usage ", 0.1))
+
+    def test_usage_rate_precision(self):
+        self.assertEqual(parseUsageDescription("Bandwidth - $0.0015 per 1 GB Usage"), ("Bandwidth ", 0.0015))
+
+    def test_usage_only_from_dollar(self):
+        """ numbers before the "- $" are part of the description and not the usage """
+        self.assertEqual(parseUsageDescription("Block 1000 IOPS - $2.50 per 4 GB Usage"), ("Block 1000 IOPS ", 2.5))
+
+    def test_no_usage(self):
+        self.assertEqual(parseUsageDescription("Flat description"), ("Flat description", ""))
+
+    def test_colon_is_not_usage(self):
+        self.assertEqual(parseUsageDescription("Snapshot Space: 20 GB"), ("Snapshot Space: 20 GB", ""))
+
+    def test_cache_reuse(self):
+        for i in range(3):
+            parseUsageDescription("Some usage - $0.10 per 3.25 GB Usage")
+        parseUsageDescription("Flat description")
+        info = parseUsageDescription.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 2))
+
+    def test_cache_bounded(self):
+        for i in range(usageDescription.descriptionCacheSize + 10):
+            parseUsageDescription("Bandwidth - ${}.5 per 1 GB Usage".format(i))
+        info = parseUsageDescription.cache_info()
+        self.assertEqual(info.currsize, usageDescription.descriptionCacheSize)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Author: Jon Hall
+# Copyright (c) 2023
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Parse the Description and childUsage columns from classic invoice child item descriptions.
+
+Descriptions without a quantity repeat across items and months, so recent descriptions are kept in a cache
+of descriptionCacheSize entries.  Most usage descriptions include the row quantity and rarely repeat, so the cache
+is bounded to keep memory from growing with the size of the invoice.  Formats handled:
+  StorageLayer   "Cloud Object Storage - Standard: 1234.56 GB"       -> ("Cloud Object Storage - Standard", 1234.56)
+                 "Cloud Object Storage - API Requests: 12345 Class A" -> ("Cloud Object Storage - API Requests", 12345.0)
+                 "Snapshot Space: 20 GB"                              -> ("Snapshot Space", 20.0)
+                 "Replication for tier: 2 IOPS"                       -> ("Replication for tier", 0)
+  Usage          "Some usage - $0.10 per 3.25 GB Usage"               -> ("Some usage ", 0.1)
+  No usage       "Flat description"                                   -> ("Flat description", "")
+"""
+
+__author__ = 'jonhall'
+import re
+from functools import lru_cache
+
+integerPattern = re.compile(r"\d+")
+decimalPattern = re.compile(r"\d+([\.,]\d+)")
+usagePattern = re.compile(r"([\d.]+)\s+(\S+)")
+
+# most recently used descriptions cached by each parser
+descriptionCacheSize = 4096
+
+
+@lru_cache(maxsize=descriptionCacheSize)
+def parseStorageLayerDescription(description):
+    """
+    Split StorageLayer child description at the ":" into (Description, childUsage)
+    """
+    desc = description.find(":")
+    if desc == -1:
+        return description, ""
+    usage = description[desc:]
+    if "API Requests" in description or "Snapshot Space" in description:
+        return description[0:desc], float(integerPattern.search(usage).group())
+    if "Replication for tier" in description:
+        return description[0:desc], 0
+    return description[0:desc], float(decimalPattern.search(usage).group())
+
+@lru_cache(maxsize=descriptionCacheSize)
+def parseUsageDescription(description):
+    """
+    Split usage child description at the "- $" into (Description, childUsage)
+    """
+    desc = description.find("- $")
+    if desc == -1:
+        return description, ""
+    usage = usagePattern.search(description, desc).group()
+    return description[0:desc], float(usage[0:usage.find("Usage") - 3])
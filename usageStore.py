@@ -0,0 +1,134 @@
+# Author: Jon Hall
+# Copyright (c) 2023
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Partitioned Parquet store used by --save / --load in invoiceAnalysis.py and ibmCloudUsage.py
+
+Each dataframe is written as a directory with one sub directory per month (hive partitioning), so a
+report can read just the months and columns it needs instead of unpickling the full history.
+"""
+
+__author__ = 'jonhall'
+import os, json, logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+def normalizeColumns(df):
+    """
+    Arrow requires a single type per column, convert object columns that mix types
+    (ie. "" used as an empty value in numeric columns) to a consistent type before writing.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        try:
+            pa.array(df[column], from_pandas=True)
+            continue
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        values = df[column].replace("", None)
+        numeric = pd.to_numeric(values, errors="coerce")
+        if numeric.notna().sum() == values.notna().sum():
+            df[column] = numeric
+        else:
+            df[column] = df[column].map(lambda value: value if value is None or value != value else str(value))
+    return df
+
+def saveUsage(df, path, partitionColumn):
+    """
+    Write dataframe to a Parquet dataset partitioned by month.  Months already in the store are replaced,
+    other months are kept so the store can be built up over several runs.
+    """
+    if len(df) == 0:
+        logging.warning("No data to save to {}.".format(path))
+        return
+    logging.info("Saving {} rows to {} partitioned by {}.".format(len(df), path, partitionColumn))
+    os.makedirs(path, exist_ok=True)
+    normalizeColumns(df).to_parquet(path, engine="pyarrow", partition_cols=[partitionColumn], index=False,
+                                    existing_data_behavior="delete_matching")
+    """
+    keep original column order, partition columns are moved to the end of the schema by Arrow.  Columns can differ
+    between runs (ie. storage_notes only with --storage) so new columns are added to the stored list, not replaced.
+    """
+    columns = getStoredColumns(path)
+    columns = columns + [column for column in df.columns if column not in columns]
+    with open(os.path.join(path, "_columns.json"), "w") as f:
+        json.dump(columns, f)
+    return
+
+def getStoredColumns(path):
+    """
+    Return list of columns saved to the store, empty if the store has not been saved yet.
+    """
+    columnsFile = os.path.join(path, "_columns.json")
+    if not os.path.exists(columnsFile):
+        return []
+    with open(columnsFile, "r") as f:
+        return json.load(f)
+
+def getUnifiedDataset(path):
+    """
+    Open the store as a dataset with the schema of every month file unified, months saved without a column read
+    it as null instead of failing the read.
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()] + [dataset.partitioning.schema]
+    schema = pa.unify_schemas(schemas, promote_options="permissive")
+    return ds.dataset(path, schema=schema, format="parquet", partitioning="hive")
+
+def getMissingStringColumns(dataset, partitionColumn):
+    """
+    Return dict of string columns and the months saved without them, getInvoiceDetail builds string columns
+    with "" as the empty value so these months are filled with "" instead of null when loaded.
+    """
+    missingColumns = {}
+    for fragment in dataset.get_fragments():
+        month = str(ds.get_partition_keys(fragment.partition_expression).get(partitionColumn))
+        names = fragment.physical_schema.names
+        for field in dataset.schema:
+            if field.name == partitionColumn or field.name in names:
+                continue
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type) or pa.types.is_null(field.type):
+                missingColumns.setdefault(field.name, set()).add(month)
+    return missingColumns
+
+def loadUsage(path, partitionColumn, startMonth=None, endMonth=None, columns=None):
+    """
+    Read dataframe from a Parquet dataset only reading the months between startMonth and endMonth (YYYY-MM)
+    and the columns requested.  If columns is None all columns are read.
+    """
+    dataset = getUnifiedDataset(path)
+    monthFilter = None
+    if startMonth != None:
+        monthFilter = ds.field(partitionColumn) >= startMonth
+    if endMonth != None:
+        endFilter = ds.field(partitionColumn) <= endMonth
+        monthFilter = endFilter if monthFilter is None else monthFilter & endFilter
+
+    storedColumns = [column for column in getStoredColumns(path) if column in dataset.schema.names]
+    if columns == None:
+        columns = storedColumns
+    else:
+        columns = [column for column in storedColumns if column in columns]
+
+    logging.info("Loading {} columns from {} for months {} to {}.".format(len(columns), path, startMonth, endMonth))
+    readColumns = columns if partitionColumn in columns else columns + [partitionColumn]
+    df = dataset.to_table(columns=readColumns, filter=monthFilter).to_pandas()
+    df[partitionColumn] = df[partitionColumn].astype(str)
+    for column, months in getMissingStringColumns(dataset, partitionColumn).items():
+        if column in columns:
+            df.loc[df[partitionColumn].isin(months) & df[column].isna(), column] = ""
+    return df[columns].reset_index(drop=True)